@@ -6,10 +6,24 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import matplotlib.font_manager as fm
 import pandas as pd
-import random
-import datetime
 import io
 import base64
+import calendar
+import time
+from array import array
+import roster_engine
+from roster_engine import recalculate_stats, run_scheduler, generate_logic_report
+from roster_export import build_export_zip
+from calendar_render import (
+    CELL_COLORS, C_TEXT, C_LINE, LEGEND_ITEMS, LEGEND_Y, WEEKDAYS_TEXT,
+    get_day_class, get_month_layout, get_title_text, render_schedule_svg, render_stats_html
+)
+from session_model import (
+    intern_roster, intern_calendar, encode_schedule, decode_schedule,
+    encode_quotas, decode_quotas, measure_session_bytes
+)
+
+_rerun_start = time.perf_counter()  # 重跑耗時量測起點
 
 # --- 1. 基礎設定 (必須放在程式碼最上方) ---
 
@@ -36,10 +50,9 @@ my_icon_url = "https://raw.githubusercontent.com/huanghhappy/duty-roster/main/lo
 setup_app_icon(my_icon_url)
 
 # 初始化 Session State
+# 只存精簡資料：共用的名單/月曆物件 + 編碼後的班表 (見 session_model.py)
 if 'generated' not in st.session_state:
     st.session_state.generated = False
-if 'result_df' not in st.session_state:
-    st.session_state.result_df = None
 
 # --- 3. 字型設定 ---
 def get_chinese_font():
@@ -54,404 +67,49 @@ def get_chinese_font():
         if os.path.exists(path): return path
     return None
 
-font_path = get_chinese_font()
-font_prop = fm.FontProperties(fname=font_path) if font_path else fm.FontProperties()
-
-# --- 4. 核心排班邏輯 & 輔助計算函式 ---
-
-def recalculate_stats(schedule, residents_data, flap_dates, weekend_dates):
-    """
-    [新增] 當使用者手動修改表格後，重新計算所有統計數據
-    """
-    # 初始化
-    stats = {r['name']: {'count': 0, 'weekend_count': 0, 'single_count': 0, 'flap_count': 0} for r in residents_data}
-    
-    for d, info in schedule.items():
-        l1 = info['line1']
-        l2 = info['line2']
-        is_single = (info['type'] == 'single')
-        
-        # 統計 Line 1
-        if l1 and l1 in stats:
-            stats[l1]['count'] += 1
-            if d in weekend_dates: stats[l1]['weekend_count'] += 1
-            
-        # 統計 Line 2
-        if l2 and l2 in stats:
-            stats[l2]['count'] += 1
-            if d in weekend_dates: stats[l2]['weekend_count'] += 1
-            
-            # Flap 班統計 (定義：Flap 日擔任二線/單人值班者)
-            if d in flap_dates:
-                stats[l2]['flap_count'] += 1
-            
-            # 單人班統計 (定義：單人班的唯一值班者)
-            if is_single:
-                stats[l2]['single_count'] += 1
-                
-    return stats
-
-def calculate_standard_8_person_shifts(residents_data, num_days):
-    r3s = sorted([r for r in residents_data if r['rank'] == 'R3'], key=lambda x: x['name'])
-    r4s = sorted([r for r in residents_data if r['rank'] == 'R4'], key=lambda x: x['name'])
-    r5s = sorted([r for r in residents_data if r['rank'] == 'R5'], key=lambda x: x['name'])
-    r6s = sorted([r for r in residents_data if r['rank'] == 'R6'], key=lambda x: x['name'])
-
-    quotas = {r['name']: 0 for r in residents_data}
-    line1_pool = r3s + r4s 
-    line2_pool = r5s + r6s
-
-    def distribute_shifts(pool, total_slots):
-        if not pool: return
-        n = len(pool)
-        base_shifts = total_slots // n
-        remainder = total_slots % n
-        for i, r in enumerate(pool):
-            extra = 1 if i < remainder else 0
-            quotas[r['name']] = base_shifts + extra
-
-    distribute_shifts(line1_pool, num_days)
-    distribute_shifts(line2_pool, num_days)
-    return quotas
-
-def calculate_scenario_and_quotas(residents_data, num_days):
-    MAX_SHIFTS = 8
-    total_slots_needed_for_double = num_days * 2
-    
-    r6s = [r for r in residents_data if r['rank'] == 'R6']
-    r5s = [r for r in residents_data if r['rank'] == 'R5']
-    r4s = [r for r in residents_data if r['rank'] == 'R4']
-    r3s = [r for r in residents_data if r['rank'] == 'R3']
-    
-    is_standard_8 = (len(r6s)==2 and len(r5s)==2 and len(r4s)==2 and len(r3s)==2)
-    
-    strict_mode = False
-    quotas = {}
-    target_double_count = num_days
-    mode = ""
-
-    if is_standard_8:
-        mode = "Standard 8-Person (Strict Line Separation)"
-        strict_mode = True
-        target_double_count = num_days
-        quotas = calculate_standard_8_person_shifts(residents_data, num_days)
-    else:
-        total_supply = len(residents_data) * MAX_SHIFTS
-        quotas = {r['name']: MAX_SHIFTS for r in residents_data}
-        
-        if total_supply >= total_slots_needed_for_double:
-            mode = "Scenario A (Surplus)"
-            excess = total_supply - total_slots_needed_for_double
-            reduce_order = r6s + r5s + r4s + r3s
-            while excess > 0:
-                reduced = False
-                for r in reduce_order:
-                    name = r['name']
-                    if quotas[name] > 7 and excess > 0:
-                        quotas[name] -= 1
-                        excess -= 1
-                        reduced = True
-                if not reduced: break
-            target_double_count = num_days
-        else:
-            mode = "Scenario B/C (Shortage)"
-            senior_role_demand = num_days
-            senior_supply = (len(r5s) + len(r6s)) * MAX_SHIFTS
-            senior_deficit = max(0, senior_role_demand - senior_supply)
-            r4_total = len(r4s) * MAX_SHIFTS
-            r4_for_line1 = max(0, r4_total - senior_deficit)
-            r3_total = len(r3s) * MAX_SHIFTS
-            total_line1_capacity = r3_total + r4_for_line1
-            target_double_count = min(num_days, total_line1_capacity)
-
-    return quotas, target_double_count, mode, strict_mode
-
-def run_scheduler(year, month, residents_data, flap_dates, fixed_shifts, vs_schedule, custom_holidays):
-    
-    num_days = pd.Period(f'{year}-{month}').days_in_month
-    dates = range(1, num_days + 1)
-    weekend_dates = custom_holidays
-
-    seniors = [r['name'] for r in residents_data if r['rank'] in ['R5', 'R6']]
-    r4s = [r['name'] for r in residents_data if r['rank'] == 'R4']
-    r3s = [r['name'] for r in residents_data if r['rank'] == 'R3']
-    all_names = [r['name'] for r in residents_data]
-    res_dict = {r['name']: r for r in residents_data}
-    
-    is_extreme_mode = (len(residents_data) <= 6)
+# 字型探測與 FontProperties 為整個 process 共用，只在第一次執行時建立
+@st.cache_resource(show_spinner=False)
+def load_font_prop():
+    font_path = get_chinese_font()
+    return fm.FontProperties(fname=font_path) if font_path else fm.FontProperties()
 
-    quotas, target_double_count, mode_desc, strict_mode = calculate_scenario_and_quotas(residents_data, num_days)
-    
-    # 極限模式彈性
-    if is_extreme_mode:
-        for name in quotas: quotas[name] += 1 
-
-    # 計算 Credits
-    if is_extreme_mode:
-        r3_shifts = len(r3s) * 8
-        r4_shifts = len(r4s) * 8
-        senior_demand = num_days
-        senior_supply = len(seniors) * 8
-        r4_support_line2 = max(0, senior_demand - senior_supply) 
-        r4_for_line1 = max(0, r4_shifts - r4_support_line2)
-        real_double_credits = r3_shifts + r4_for_line1
-        target_double_count = min(num_days, real_double_credits)
-
-    locked_junior_dates = set()
-    for name, locked_days in fixed_shifts.items():
-        if res_dict[name]['rank'] in ['R3', 'R4']:
-            for d in locked_days: locked_junior_dates.add(d)
-
-    # --- Monte Carlo 模擬 ---
-    for attempt in range(5000):
-        schedule = {d: {'line1': None, 'line2': None, 'type': 'single', 'warning': ''} for d in dates}
-        res_state = {name: {'count': 0, 'dates': [], 'weekend_count': 0, 'single_count': 0, 'flap_count': 0} for name in all_names}
-        possible = True
-        
-        # 配額分配
-        current_credits = target_double_count
-        double_days = set()
-        
-        for d in locked_junior_dates:
-            double_days.add(d)
-            if current_credits > 0: current_credits -= 1
+font_prop = load_font_prop()
 
-        pool_flap = [d for d in dates if d in flap_dates and d not in double_days]
-        pool_holiday = [d for d in dates if d in weekend_dates and d not in flap_dates and d not in double_days]
-        pool_weekday = [d for d in dates if d not in flap_dates and d not in weekend_dates and d not in double_days]
-        
-        random.shuffle(pool_flap)
-        random.shuffle(pool_holiday)
-        random.shuffle(pool_weekday)
-        
-        priority_list = pool_flap + pool_holiday + pool_weekday    
-        for d in priority_list:
-            if current_credits > 0:
-                double_days.add(d)
-                current_credits -= 1
-        
-        for d in dates:
-            if d in double_days: schedule[d]['type'] = 'double'
-            else: schedule[d]['type'] = 'single'
-
-        # Check Availability Helper
-        def is_available(name, day, strict_consecutive=True, strict_quota=True):
-            if day in res_dict[name]['unavailable']: return False
-            if day in res_state[name]['dates']: return False 
-            if strict_quota and res_state[name]['count'] >= quotas[name]: return False
-            if strict_consecutive:
-                if (day - 1) in res_state[name]['dates']: return False 
-                if (day + 1) in res_state[name]['dates']: return False
-            return True
-
-        # Phase 1: Fixed Shifts
-        fixed_items = list(fixed_shifts.items())
-        random.shuffle(fixed_items)
-        for p_name, p_dates in fixed_items:
-            rank = res_dict[p_name]['rank']
-            for d in p_dates:
-                if d not in res_state[p_name]['dates']:
-                    res_state[p_name]['count'] += 1
-                    res_state[p_name]['dates'].append(d)
-                    if d in weekend_dates: res_state[p_name]['weekend_count'] += 1
-                
-                is_single = (schedule[d]['type'] == 'single')
-                if rank == 'R3':
-                    schedule[d]['line1'] = p_name
-                    if is_single: schedule[d]['type'] = 'double'
-                elif rank in ['R5', 'R6']:
-                    schedule[d]['line2'] = p_name
-                elif rank == 'R4':
-                    if is_single: schedule[d]['line2'] = p_name
-                    else:
-                        if schedule[d]['line1']: schedule[d]['line2'] = p_name
-                        else: schedule[d]['line1'] = p_name
-
-        # Phase 2: Fill Line 2
-        senior_slots = []
-        for d in dates:
-            if schedule[d]['line2'] is None:
-                is_flap = d in flap_dates
-                is_weekend = d in weekend_dates
-                priority = 0
-                if is_extreme_mode:
-                    if is_weekend: priority = 200 
-                    elif is_flap: priority = 100
-                    else: priority = 10
-                else:
-                    if is_flap: priority = 100
-                    elif is_weekend: priority = 50
-                    else: priority = 10
-                senior_slots.append((d, priority))
-        
-        senior_slots.sort(key=lambda x: x[1], reverse=True)
-        
-        for d, prio in senior_slots:
-            pool = []
-            if strict_mode and not is_extreme_mode: pool = seniors
-            else: pool = seniors + r4s
-            l1 = schedule[d]['line1']
-            current_pool = [p for p in pool if p != l1]
-
-            cands = [p for p in current_pool if is_available(p, d, True, True)]
-            if not cands:
-                cands = [p for p in current_pool if is_available(p, d, False, True)]
-                if cands: schedule[d]['warning'] += '連值 '
-            if not cands:
-                cands = [p for p in current_pool if is_available(p, d, True, False)]
-                if cands: schedule[d]['warning'] += '超班 '
-            if not cands:
-                cands = [p for p in current_pool if is_available(p, d, False, False)]
-                if cands: schedule[d]['warning'] += '連值+超班 '
-
-            if cands:
-                def get_p2_key(n):
-                    rank = res_dict[n]['rank']
-                    st_score = 10
-                    if is_extreme_mode:
-                        if (d in weekend_dates): st_score = 0 if rank=='R4' else 1
-                        elif (d in flap_dates): st_score = 0 if rank in ['R5','R6'] else 1
-                        else: st_score = 0 if rank in ['R5','R6'] else 1
-                    else: st_score = 0 if rank in ['R5','R6'] else 1
-                    return (st_score, res_state[n]['count'], random.random())
-                
-                cands.sort(key=get_p2_key)
-                best = cands[0]
-                schedule[d]['line2'] = best
-                res_state[best]['count'] += 1
-                res_state[best]['dates'].append(d)
-                if d in weekend_dates: res_state[best]['weekend_count'] += 1
-            else:
-                possible = False; break
+# --- 3.1 依輸入快取的衍生資料 (每次 rerun 不再重算) ---
 
-        if not possible: continue
+@st.cache_data(show_spinner=False)
+def get_default_weekends(year, month):
+    return roster_engine.get_default_weekends(year, month)
 
-        # Phase 3: Fill Line 1
-        junior_slots = [d for d in dates if schedule[d]['type'] == 'double' and schedule[d]['line1'] is None]
-        junior_slots.sort(key=lambda x: (0 if x in flap_dates else 1, 0 if x in weekend_dates else 1))
-        
-        for d in junior_slots:
-            pool = r3s + r4s
-            l2 = schedule[d]['line2']
-            current_pool = [p for p in pool if p != l2]
-            
-            cands = [p for p in current_pool if is_available(p, d, True, True)]
-            if not cands:
-                cands = [p for p in current_pool if is_available(p, d, False, True)]
-                if cands: schedule[d]['warning'] += 'L1連值 '
-            if not cands:
-                cands = [p for p in current_pool if is_available(p, d, True, False)]
-                 
-            if cands:
-                cands.sort(key=lambda n: (res_state[n]['count'], random.random()))
-                best = cands[0]
-                schedule[d]['line1'] = best
-                res_state[best]['count'] += 1
-                res_state[best]['dates'].append(d)
-                if d in weekend_dates: res_state[best]['weekend_count'] += 1
-            else:
-                schedule[d]['type'] = 'single'
-                if 'L1連值' in schedule[d]['warning']: schedule[d]['warning'] = schedule[d]['warning'].replace('L1連值', '')
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_schedule_df(year, month, schedule):
+    """
+    [新增] 人工微調編輯器用的表格 (以欄為單位一次建立)
+    """
+    weekdays_text = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    start_weekday = calendar.weekday(year, month, 1)
+    days = list(schedule)
+    # 處理 None 值轉換為空字串，方便編輯器顯示
+    l1 = [schedule[d]['line1'] or "" for d in days]
+    l2 = [schedule[d]['line2'] or "" for d in days]
+    return pd.DataFrame({
+        "日期": days,
+        "星期": [weekdays_text[(start_weekday + d - 1) % 7] for d in days],
+        # 這裡的「班別」僅作為顯示用，稍後會被自動邏輯覆蓋
+        "班別": ["雙人" if (a and b) else "單人" for a, b in zip(l1, l2)],
+        "一線 (Line 1)": l1,
+        "二線 (Line 2)": l2,
+    })
 
-        # Phase 4: Smart Rebalance
-        target_shift_per_person = 8
-        over_seniors = [n for n in seniors if res_state[n]['count'] > target_shift_per_person]
-        under_r4s = [n for n in r4s if res_state[n]['count'] < target_shift_per_person]
-        
-        if over_seniors and under_r4s:
-            swap_candidates = []
-            for d in dates:
-                l2 = schedule[d]['line2']
-                if l2 in over_seniors and d not in weekend_dates:
-                    priority = 0
-                    if d in flap_dates: priority = 10 
-                    elif schedule[d]['type'] == 'single': priority = 5 
-                    else: priority = 1
-                    swap_candidates.append((d, l2, priority))
-            
-            swap_candidates.sort(key=lambda x: x[2], reverse=True)
-            
-            for d, senior_name, prio in swap_candidates:
-                under_r4s = [n for n in r4s if res_state[n]['count'] < target_shift_per_person]
-                if not under_r4s: break
-                valid_r4 = [r for r in under_r4s if is_available(r, d, True, False) and r != schedule[d]['line1']]
-                if valid_r4 and res_state[senior_name]['count'] > target_shift_per_person:
-                    r4_name = valid_r4[0]
-                    schedule[d]['line2'] = r4_name
-                    res_state[senior_name]['count'] -= 1
-                    res_state[senior_name]['dates'].remove(d)
-                    res_state[r4_name]['count'] += 1
-                    res_state[r4_name]['dates'].append(d)
-
-        under_r3s = [n for n in r3s if res_state[n]['count'] < target_shift_per_person]
-        if under_r3s:
-            single_days = [d for d in dates if schedule[d]['type'] == 'single']
-            single_days.sort(key=lambda x: 10 if x in flap_dates else 1, reverse=True)
-            for d in single_days:
-                under_r3s = [n for n in r3s if res_state[n]['count'] < target_shift_per_person]
-                if not under_r3s: break
-                l2 = schedule[d]['line2']
-                valid_r3 = [r for r in under_r3s if is_available(r, d, True, False) and r != l2]
-                if valid_r3:
-                    r3_name = valid_r3[0]
-                    schedule[d]['line1'] = r3_name
-                    schedule[d]['type'] = 'double'
-                    res_state[r3_name]['count'] += 1
-                    res_state[r3_name]['dates'].append(d)
-                    if d in weekend_dates: res_state[r3_name]['weekend_count'] += 1
-
-        # 最終統計 (初次)
-        stats = recalculate_stats(schedule, residents_data, flap_dates, weekend_dates)
-        return schedule, stats, mode_desc, quotas
-
-    return None, None, None, None
+# --- 4. 核心排班邏輯 & 輔助計算函式 ---
+# 已移至 roster_engine.py (HTTP 服務亦共用)
 
 # --- 5. 生成報告與圖表 ---
 
-def generate_logic_report(year, month, schedule, stats, mode, quotas, residents_data, flap_dates, weekend_dates):
-    lines = []
-    lines.append(f"【智能排班邏輯說明報告】 {year}年{month}月")
-    lines.append("="*40)
-    
-    single_count = sum(1 for d in schedule if schedule[d]['type'] == 'single')
-    
-    lines.append(f"1. 判斷場景：{mode}")
-    if "Standard 8-Person" in mode:
-        lines.append(f"   - 啟動【8人標準模式】：嚴格執行職級分流。")
-        lines.append(f"   - 一線班(Line 1)：僅由 R3、R4 擔任。")
-        lines.append(f"   - 二線班(Line 2)：僅由 R5、R6 擔任。")
-        lines.append(f"   - 班數分配：資淺者(R3, R5)優先承擔剩餘班數(例如30天=R6七班+R5八班)。")
-    elif single_count > 0:
-        lines.append(f"   - 因人力結構限制，本月安排 {single_count} 天單人值班。")
-        lines.append(f"   - 單人班已依照痛苦程度 (Flap單人 > 假日單人 > 平日單人) 盡量避免高痛點。")
-    else:
-        lines.append(f"   - 人力充足，全月雙人值班。")
-    
-    lines.append(f"\n2. 醫師目標班數：")
-    for r in residents_data:
-        lines.append(f"   - {r['name']}: 目標 {quotas[r['name']]} 班 | 實際 {stats[r['name']]['count']} 班")
-    
-    lines.append(f"\n3. 公平性數據 (Flap班僅統計二線/單人)：")
-    lines.append(f"   {'醫師':<6} {'總班':<4} {'假日':<4} {'單人':<4} {'Flap':<4}")
-    lines.append("-" * 40)
-    for r in residents_data:
-        n = r['name']
-        s = stats[n]
-        lines.append(f"   {n:<6} {s['count']:<4} {s['weekend_count']:<4} {s['single_count']:<4} {s['flap_count']:<4}")
-
-    return "\n".join(lines)
-
 def plot_schedule(year, month, schedule, flap_dates, weekend_dates, vs_schedule, font_prop, mode, residents_data):
-    # Colors
-    c_double_flap = '#E8F5E9'     
-    c_double_holiday = '#FFEBEE'  
-    c_double_normal = '#FFFFFF'   
-    c_single_normal = '#FFF9C4'   
-    c_single_holiday = '#F48FB1'  
-    c_deep_green = '#81C784'      # 深綠 (Flap單人 OR R4扛Flap二線)
-    c_deep_yellow = '#FFB74D'     # 深黃 (R4單人 OR R4扛一般二線)
-    c_text = '#424242'
-    c_line = '#E0E0E0'
+    # Colors (與 SVG 預覽共用，見 calendar_render.CELL_COLORS)
+    c_text = C_TEXT
+    c_line = C_LINE
 
     r4_names = [r['name'] for r in residents_data if r['rank'] == 'R4']
 
@@ -460,15 +118,10 @@ def plot_schedule(year, month, schedule, flap_dates, weekend_dates, vs_schedule,
     ax.set_ylim(-1.5, 6) 
     ax.axis('off')
 
-    cal = pd.Period(f'{year}-{month}')
-    start_weekday = datetime.date(year, month, 1).weekday()
-    days_in_month = cal.days_in_month
-    weeks = (start_weekday + days_in_month) // 7 + 1
-    if (start_weekday + days_in_month) % 7 == 0: weeks -= 1
+    start_weekday, days_in_month, weeks = get_month_layout(year, month)
     row_height = (6 - 0.5) / weeks
     
-    weekdays_text = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
-    for i, d in enumerate(weekdays_text):
+    for i, d in enumerate(WEEKDAYS_TEXT):
         ax.text(i + 0.5, 6 - 0.25, d, ha='center', va='center', fontsize=12, fontweight='bold', color=c_text)
 
     current_day = 1
@@ -489,21 +142,8 @@ def plot_schedule(year, month, schedule, flap_dates, weekend_dates, vs_schedule,
             
             l1, l2 = info['line1'], info['line2']
             name_on_duty_l2 = l2 if l2 else l1
-            is_r4_duty = (name_on_duty_l2 in r4_names)
 
-            bg_color = c_double_normal 
-            if is_r4_duty:
-                if is_flap: bg_color = c_deep_green
-                else: bg_color = c_deep_yellow
-            else:
-                if is_single:
-                    if is_flap: bg_color = c_deep_green    
-                    elif is_holiday: bg_color = c_single_holiday 
-                    else: bg_color = c_single_normal       
-                else:
-                    if is_flap: bg_color = c_double_flap   
-                    elif is_holiday: bg_color = c_double_holiday 
-                    else: bg_color = c_double_normal       
+            bg_color = CELL_COLORS[get_day_class(info, is_flap, is_holiday, r4_names)]
             
             ax.add_patch(patches.Rectangle((x, y_bot), 1, row_height, linewidth=1, edgecolor=c_line, facecolor=bg_color))
             day_text = str(current_day)
@@ -517,30 +157,16 @@ def plot_schedule(year, month, schedule, flap_dates, weekend_dates, vs_schedule,
                 ax.text(x + 0.5, y_bot + row_height*0.25, str(l2) if l2 else "-", ha='center', va='center', fontsize=14, color=c_text, fontproperties=font_prop)
             current_day += 1
             
-    title_text = f'{year}年 {month}月 住院醫師班表'
-    if "Standard" in mode: title_text += " (標準模式)"
-    elif "Scenario A" in mode: title_text += " (人力充足)"
-    else: title_text += " (缺工模式)"
+    title_text = get_title_text(year, month, mode)
     
     ax.text(3.5, 6.2, title_text, ha='center', va='center', fontsize=18, fontweight='bold', color=c_text, fontproperties=font_prop)
 
-    legend_y = -0.6
-    ax.text(0.5, legend_y, "底色說明：", fontsize=12, fontweight='bold', color=c_text, fontproperties=font_prop)
-    
-    ax.add_patch(patches.Rectangle((1.5, legend_y-0.15), 0.3, 0.3, facecolor=c_double_flap, edgecolor='gray')); 
-    ax.text(1.9, legend_y, "Flap雙人", va='center', fontsize=10, fontproperties=font_prop)
-    ax.add_patch(patches.Rectangle((3.0, legend_y-0.15), 0.3, 0.3, facecolor=c_double_holiday, edgecolor='gray')); 
-    ax.text(3.4, legend_y, "假日雙人", va='center', fontsize=10, fontproperties=font_prop)
-    ax.add_patch(patches.Rectangle((4.5, legend_y-0.15), 0.3, 0.3, facecolor=c_single_normal, edgecolor='gray')); 
-    ax.text(4.9, legend_y, "平日單人", va='center', fontsize=10, fontproperties=font_prop)
+    ax.text(0.5, LEGEND_Y[0], "底色說明：", fontsize=12, fontweight='bold', color=c_text, fontproperties=font_prop)
     
-    legend_y2 = -1.0
-    ax.add_patch(patches.Rectangle((1.5, legend_y2-0.15), 0.3, 0.3, facecolor=c_deep_green, edgecolor='gray')); 
-    ax.text(1.9, legend_y2, "Flap單人/R4", va='center', fontsize=10, fontproperties=font_prop)
-    ax.add_patch(patches.Rectangle((3.0, legend_y2-0.15), 0.3, 0.3, facecolor=c_single_holiday, edgecolor='gray')); 
-    ax.text(3.4, legend_y2, "假日單人", va='center', fontsize=10, fontproperties=font_prop)
-    ax.add_patch(patches.Rectangle((4.5, legend_y2-0.15), 0.3, 0.3, facecolor=c_deep_yellow, edgecolor='gray')); 
-    ax.text(4.9, legend_y2, "R4單人/二線", va='center', fontsize=10, fontproperties=font_prop)
+    for row, lx, cls, label in LEGEND_ITEMS:
+        ly = LEGEND_Y[row]
+        ax.add_patch(patches.Rectangle((lx, ly-0.15), 0.3, 0.3, facecolor=CELL_COLORS[cls], edgecolor='gray'))
+        ax.text(lx + 0.4, ly, label, va='center', fontsize=10, fontproperties=font_prop)
     
     return fig
 
@@ -580,11 +206,11 @@ with col_b:
     6. **跨級補位**：極限場景需R4跨級填補部分資深人力缺口，確保排班成功率。
     7. **永不失敗**：人力鎖死的自動降級生存機制，解鎖連值/超班，杜絕系統崩潰。
     8. **人工微調**：演算法生成後可手動介入，彈性調整班表，補足人性化排班最後一哩路。
-    9. **完整輸出**：一鍵同時產出「班表圖檔」、「班數統計圖表」、「智能排班邏輯說明」。
+    9. **完整輸出**：一鍵同時產出「班表圖檔」、「班數統計圖表」、「智能排班邏輯說明」，以及個人行事曆 (.ics) 與全科試算表 (.xlsx/.csv)。
     10. **視覺警示**：班表圖檔採視覺化底色分級，區分該班別的風險等級與人力配置狀況。
     """)
 
-days_in_month = pd.Period(f'{year}-{month}').days_in_month
+days_in_month = calendar.monthrange(year, month)[1]
 all_days = list(range(1, days_in_month + 1))
 
 st.header("1. 當月值班住院醫師名單")
@@ -607,10 +233,7 @@ st.header("2. 已知 flap combine 刀日")
 flap_input = st.multiselect("請選擇目前已知日期", all_days)
 
 st.header("3. 當月假日 (含國定假日/彈性假日)")
-default_weekends = []
-for d in all_days:
-    dt = datetime.date(year, month, d)
-    if dt.weekday() >= 5: default_weekends.append(d)
+default_weekends = get_default_weekends(year, month)
 holiday_input = st.multiselect("請確認假日 (系統預設週六日，可自行增減)", all_days, default=default_weekends)
 
 st.header("4. VS 輪值名單")
@@ -627,16 +250,13 @@ if st.button("🚀 生成班表", type="primary"):
     with st.spinner("正在進行 Monte Carlo 模擬運算 (全場景通用)..."):
         schedule, stats, mode, quotas = run_scheduler(year, month, residents_input, flap_input, fixed_shifts_map, vs_input, holiday_input)
         if schedule:
+            roster = intern_roster(residents_input)
             st.session_state.generated = True
-            st.session_state.schedule = schedule
-            st.session_state.stats = stats
-            st.session_state.quotas = quotas
+            st.session_state.roster = roster
+            st.session_state.month_calendar = intern_calendar(year, month, flap_input, holiday_input, vs_input)
+            st.session_state.schedule = encode_schedule(schedule, roster)
+            st.session_state.quotas = encode_quotas(quotas, roster)
             st.session_state.mode = mode
-            st.session_state.residents_data = residents_input
-            st.session_state.flap_input = flap_input
-            st.session_state.holiday_input = holiday_input
-            st.session_state.vs_input = vs_input
-            st.session_state.font_prop = font_prop
             st.rerun()
         else:
             st.error(f"❌ 排班失敗。請確認是否鎖定日期衝突過多。")
@@ -650,35 +270,20 @@ if st.session_state.generated:
     st.header("✏️ 人工微調編輯器")
     st.info("💡 使用說明：可直接在下方表格修改「一線」或「二線」醫師，**「班別」會依據人數自動切換 (單人/雙人)**。修改後圖表將即時更新。")
     
-    # 1. 準備資料給 st.data_editor
-    current_schedule = st.session_state.schedule
-    schedule_data = []
-    
-    # 建立日期與星期對照
-    weekdays_map = {0: 'Mon', 1: 'Tue', 2: 'Wed', 3: 'Thu', 4: 'Fri', 5: 'Sat', 6: 'Sun'}
+    # 0. 由精簡 session 還原本次 rerun 需要的資料 (統計數據不存，每次由班表重算)
+    roster = st.session_state.roster
+    month_cal = st.session_state.month_calendar
+    sch_year, sch_month = month_cal.year, month_cal.month
+    residents_data = roster.residents
+    mode = st.session_state.mode
+    quotas = decode_quotas(st.session_state.quotas, roster)
     
-    for d, info in current_schedule.items():
-        dt = datetime.date(year, month, d)
-        wd = weekdays_map[dt.weekday()]
-        
-        # 處理 None 值轉換為空字串，方便編輯器顯示
-        l1 = info['line1'] if info['line1'] else ""
-        l2 = info['line2'] if info['line2'] else ""
-        
-        # 這裡的「班別」僅作為顯示用，稍後會被自動邏輯覆蓋
-        schedule_data.append({
-            "日期": d,
-            "星期": wd,
-            "班別": "雙人" if (l1 and l2) else "單人", # 預設依據目前狀態顯示
-            "一線 (Line 1)": l1,
-            "二線 (Line 2)": l2
-        })
-    
-    df_schedule = pd.DataFrame(schedule_data)
+    # 1. 準備資料給 st.data_editor
+    current_schedule = decode_schedule(st.session_state.schedule, roster)
+    df_schedule = build_schedule_df(sch_year, sch_month, current_schedule)
     
     # 準備下拉選單選項 (包含一個空選項，代表沒人/刪除)
-    resident_names = [r['name'] for r in st.session_state.residents_data]
-    resident_options = [""] + resident_names
+    resident_options = [""] + list(roster.names)
     
     # 2. 顯示編輯器
     edited_df = st.data_editor(
@@ -696,96 +301,118 @@ if st.session_state.generated:
     )
     
     # 3. 處理變更 & 執行自動邏輯 (Auto-Logic)
-    new_schedule = {}
-    has_changes = False # 偵測是否有變動
-    
-    for index, row in edited_df.iterrows():
-        d = row["日期"]
-        
-        # 讀取使用者選擇的醫師 (空字串轉回 None)
-        l1 = row["一線 (Line 1)"] if row["一線 (Line 1)"] != "" else None
-        l2 = row["二線 (Line 2)"] if row["二線 (Line 2)"] != "" else None
-        
-        # --- [關鍵優化] 自動判斷班別 ---
-        # 邏輯：只要一二線都有人，就是雙人；否則就是單人
-        # 這會自動覆蓋掉舊的 type，實現自動連動
-        calculated_type = 'double' if (l1 and l2) else 'single'
-        
-        # 檢查是否跟原本狀態不同 (用於決定是否 Rerun)
-        original_info = st.session_state.schedule[d]
-        if (original_info['line1'] != l1) or \
-           (original_info['line2'] != l2) or \
-           (original_info['type'] != calculated_type):
-            has_changes = True
-
-        new_schedule[d] = {
-            'line1': l1,
-            'line2': l2,
-            'type': calculated_type, # 強制使用自動判斷的結果
-            'warning': '' # 手動修改後清除自動生成的 warning
-        }
+    # 以欄為單位比對，避免逐列 iterrows
+    # 讀取使用者選擇的醫師 (None/NaN 一律視為空字串)
+    new_l1 = edited_df["一線 (Line 1)"].fillna("").astype(str)
+    new_l2 = edited_df["二線 (Line 2)"].fillna("").astype(str)
+    
+    # --- [關鍵優化] 自動判斷班別 ---
+    # 邏輯：只要一二線都有人，就是雙人；否則就是單人
+    # 這會自動覆蓋掉舊的 type，實現自動連動
+    is_double = (new_l1 != "") & (new_l2 != "")
+    
+    # 檢查是否跟原本狀態不同 (用於決定是否 Rerun)
+    original_double = pd.Series([current_schedule[d]['type'] == 'double' for d in df_schedule["日期"]], index=edited_df.index)
+    has_changes = bool(
+        (new_l1 != df_schedule["一線 (Line 1)"].values).any() or
+        (new_l2 != df_schedule["二線 (Line 2)"].values).any() or
+        (is_double != original_double).any()
+    )
     
     # 4. 如果偵測到變動：更新 State 並強制 Rerun
     if has_changes:
-        st.session_state.schedule = new_schedule
-        
-        # 重新計算統計數據
-        new_stats = recalculate_stats(
-            new_schedule, 
-            st.session_state.residents_data, 
-            st.session_state.flap_input, 
-            st.session_state.holiday_input
-        )
-        st.session_state.stats = new_stats
+        new_schedule = {
+            int(d): {
+                'line1': l1 or None,
+                'line2': l2 or None,
+                'type': 'double' if dbl else 'single', # 強制使用自動判斷的結果
+                'warning': '' # 手動修改後清除自動生成的 warning
+            }
+            for d, l1, l2, dbl in zip(edited_df["日期"], new_l1, new_l2, is_double)
+        }
+        st.session_state.schedule = encode_schedule(new_schedule, roster)
         
         # [關鍵] 強制重新執行 (Rerun)
         # 這能解決「點擊兩次才生效」的問題，讓修改瞬間反應到圖表和表格上
         st.rerun()
 
     # --- 5. 繪圖與下載區 (使用最新的 State 繪製) ---
+    # 預覽使用 SVG/HTML 直接輸出；matplotlib 只在按下 PNG 下載時才繪製 (高 DPI)
     
-    fig_schedule = plot_schedule(
-        year, month, st.session_state.schedule, 
-        st.session_state.flap_input, 
-        st.session_state.holiday_input, 
-        st.session_state.vs_input, 
-        st.session_state.font_prop, 
-        st.session_state.mode, 
-        st.session_state.residents_data
-    )
+    stats = recalculate_stats(current_schedule, residents_data, month_cal.flap_dates, month_cal.weekend_dates)
     
-    fig_stats = plot_stats_table(
-        st.session_state.stats, 
-        st.session_state.quotas, 
-        st.session_state.residents_data, 
-        st.session_state.font_prop
+    svg_schedule = render_schedule_svg(
+        sch_year, sch_month, current_schedule, 
+        month_cal.flap_dates, 
+        month_cal.weekend_dates, 
+        month_cal.vs_schedule, 
+        mode, 
+        residents_data
     )
     
+    html_stats = render_stats_html(stats, quotas, residents_data)
+    
     report_text = generate_logic_report(
-        year, month, st.session_state.schedule, st.session_state.stats, 
-        st.session_state.mode, st.session_state.quotas, 
-        st.session_state.residents_data, 
-        st.session_state.flap_input, 
-        st.session_state.holiday_input
+        sch_year, sch_month, current_schedule, stats, 
+        mode, quotas, residents_data, 
+        month_cal.flap_dates, 
+        month_cal.weekend_dates
     )
 
-    st.success(f"✅ 當前班表狀態 (模式：{st.session_state.mode})")
+    st.success(f"✅ 當前班表狀態 (模式：{mode})")
     
     st.subheader("📊 班表預覽")
-    st.pyplot(fig_schedule)
+    st.markdown(svg_schedule, unsafe_allow_html=True)
     
     st.subheader("📈 統計數據")
-    st.pyplot(fig_stats)
+    st.markdown(html_stats, unsafe_allow_html=True)
     
     st.subheader("📥 匯出檔案")
-    c1, c2, c3 = st.columns(3)
-    
-    buf_sch = io.BytesIO()
-    fig_schedule.savefig(buf_sch, format="png", dpi=200, bbox_inches='tight')
-    c1.download_button("⬇️ 下載班表圖檔 (.png)", buf_sch.getvalue(), f"schedule_{year}_{month}.png", "image/png")
-    
-    buf_stat = io.BytesIO()
-    fig_stats.savefig(buf_stat, format="png", dpi=200, bbox_inches='tight')
-    c2.download_button("⬇️ 下載班數統計圖表 (.png)", buf_stat.getvalue(), f"stats_{year}_{month}.png", "image/png")
-    
-    c3.download_button("⬇️ 下載智能排班邏輯說明 (.txt)", report_text, f"report_{year}_{month}.txt", "text/plain")
+    c1, c2, c3, c4 = st.columns(4)
+    
+    # 下載時才執行 (另一個 thread)，只綁定共用物件與編碼後的班表，不另存副本
+    def export_schedule_png(packed=st.session_state.schedule, roster=roster, month_cal=month_cal, mode=mode):
+        schedule = decode_schedule(packed, roster)
+        fig = plot_schedule(month_cal.year, month_cal.month, schedule, month_cal.flap_dates, month_cal.weekend_dates,
+                            month_cal.vs_schedule, font_prop, mode, roster.residents)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=200, bbox_inches='tight')
+        plt.close(fig)
+        return buf.getvalue()
+    
+    def export_stats_png(packed=st.session_state.schedule, packed_quotas=st.session_state.quotas,
+                         roster=roster, month_cal=month_cal):
+        stats = recalculate_stats(decode_schedule(packed, roster), roster.residents, month_cal.flap_dates, month_cal.weekend_dates)
+        fig = plot_stats_table(stats, decode_quotas(packed_quotas, roster), roster.residents, font_prop)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=200, bbox_inches='tight')
+        plt.close(fig)
+        return buf.getvalue()
+    
+    c1.download_button("⬇️ 下載班表圖檔 (.png)", export_schedule_png, f"schedule_{sch_year}_{sch_month}.png", "image/png")
+    c2.download_button("⬇️ 下載班數統計圖表 (.png)", export_stats_png, f"stats_{sch_year}_{sch_month}.png", "image/png")
+    
+    c3.download_button("⬇️ 下載智能排班邏輯說明 (.txt)", report_text, f"report_{sch_year}_{sch_month}.txt", "text/plain")
+
+    def export_roster_zip(packed=st.session_state.schedule, roster=roster, month_cal=month_cal):
+        rosters = [(month_cal.year, month_cal.month, decode_schedule(packed, roster), month_cal.flap_dates, month_cal.weekend_dates)]
+        return build_export_zip(rosters, roster.residents, f"{month_cal.year}_{month_cal.month}")
+    
+    c4.download_button("⬇️ 下載行事曆/試算表 (.zip)", export_roster_zip, f"roster_{sch_year}_{sch_month}.zip", "application/zip")
+
+# --- 7. 重跑耗時量測 (rerun-latency mode) ---
+# 只記錄完整跑完的 rerun (呼叫 st.rerun() 中斷的不計)，保留最近 50 次
+rerun_ms = (time.perf_counter() - _rerun_start) * 1000
+rerun_history = st.session_state.setdefault('rerun_ms', array('f'))
+rerun_history.append(rerun_ms)
+del rerun_history[:-50]
+
+if st.sidebar.toggle("⏱️ 顯示重跑耗時", key="show_rerun_latency"):
+    recent = sorted(rerun_history)
+    st.sidebar.metric("本次 rerun", f"{rerun_ms:.1f} ms")
+    st.sidebar.caption(
+        f"最近 {len(recent)} 次：中位數 {recent[len(recent) // 2]:.1f} ms / 最大 {recent[-1]:.1f} ms"
+    )
+    # 每個 session 的記憶體 (共用名單/月曆另計)
+    own_bytes, shared_bytes = measure_session_bytes(st.session_state.to_dict())
+    st.sidebar.caption(f"Session 記憶體：約 {own_bytes / 1024:.1f} KB (共用物件 {shared_bytes / 1024:.1f} KB)")
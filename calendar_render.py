@@ -0,0 +1,159 @@
+import calendar
+import html
+
+# --- 班表底色分級 (matplotlib 與 SVG 共用) ---
+CELL_COLORS = {
+    'c_double_flap': '#E8F5E9',
+    'c_double_holiday': '#FFEBEE',
+    'c_double_normal': '#FFFFFF',
+    'c_single_normal': '#FFF9C4',
+    'c_single_holiday': '#F48FB1',
+    'c_deep_green': '#81C784',    # 深綠 (Flap單人 OR R4扛Flap二線)
+    'c_deep_yellow': '#FFB74D',   # 深黃 (R4單人 OR R4扛一般二線)
+}
+C_TEXT = '#424242'
+C_LINE = '#E0E0E0'
+
+# (列, x 位置, 底色, 說明)
+LEGEND_ITEMS = [
+    (0, 1.5, 'c_double_flap', "Flap雙人"),
+    (0, 3.0, 'c_double_holiday', "假日雙人"),
+    (0, 4.5, 'c_single_normal', "平日單人"),
+    (1, 1.5, 'c_deep_green', "Flap單人/R4"),
+    (1, 3.0, 'c_single_holiday', "假日單人"),
+    (1, 4.5, 'c_deep_yellow', "R4單人/二線"),
+]
+LEGEND_Y = [-0.6, -1.0]
+WEEKDAYS_TEXT = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+
+
+def get_day_class(info, is_flap, is_holiday, r4_names):
+    """
+    依班別 / Flap / 假日 / R4 扛二線 判斷當日底色 (回傳 CELL_COLORS 的 key)
+    """
+    is_single = (info['type'] == 'single')
+    l1, l2 = info['line1'], info['line2']
+    name_on_duty_l2 = l2 if l2 else l1
+
+    if name_on_duty_l2 in r4_names:
+        return 'c_deep_green' if is_flap else 'c_deep_yellow'
+    if is_single:
+        if is_flap: return 'c_deep_green'
+        if is_holiday: return 'c_single_holiday'
+        return 'c_single_normal'
+    if is_flap: return 'c_double_flap'
+    if is_holiday: return 'c_double_holiday'
+    return 'c_double_normal'
+
+
+def get_month_layout(year, month):
+    start_weekday, days_in_month = calendar.monthrange(year, month)
+    weeks = (start_weekday + days_in_month) // 7 + 1
+    if (start_weekday + days_in_month) % 7 == 0: weeks -= 1
+    return start_weekday, days_in_month, weeks
+
+
+def get_title_text(year, month, mode):
+    title_text = f'{year}年 {month}月 住院醫師班表'
+    if "Standard" in mode: title_text += " (標準模式)"
+    elif "Scenario A" in mode: title_text += " (人力充足)"
+    else: title_text += " (缺工模式)"
+    return title_text
+
+
+# --- SVG 輕量繪製 (預覽用，不經過 matplotlib) ---
+# 座標沿用 plot_schedule 的 axes 座標 (x: 0~7, y: -1.5~6)，再換算成 SVG 像素
+
+_SCALE = 100
+_X0, _Y_TOP = -0.8, 6.5
+SVG_ID = 'roster-cal'    # 樣式只套用在此 id 底下，避免影響 Streamlit 頁面上的其他元素
+
+
+def _px(x):
+    return round((x - _X0) * _SCALE, 1)
+
+
+def _py(y):
+    return round((_Y_TOP - y) * _SCALE, 1)
+
+
+def render_schedule_svg(year, month, schedule, flap_dates, weekend_dates, vs_schedule, mode, residents_data):
+    """
+    [新增] 以 SVG 直接輸出班表，版面與底色說明與 plot_schedule 相同
+    """
+    r4_names = {r['name'] for r in residents_data if r['rank'] == 'R4'}
+    flap_set, weekend_set = set(flap_dates), set(weekend_dates)
+    start_weekday, days_in_month, weeks = get_month_layout(year, month)
+    row_height = (6 - 0.5) / weeks
+    esc = html.escape
+
+    width, height = _px(7.1), _py(-1.5)
+    out = [
+        f'<svg id="{SVG_ID}" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" width="100%" '
+        f'style="max-width:900px;height:auto" font-family="\'Noto Sans TC\',\'Microsoft JhengHei\',\'PingFang TC\',sans-serif">',
+        '<style>',
+        f'#{SVG_ID} text{{fill:{C_TEXT}}}#{SVG_ID} .b{{font-weight:bold}}#{SVG_ID} .c{{text-anchor:middle;dominant-baseline:central}}'
+        f'#{SVG_ID} .cell{{stroke:{C_LINE};stroke-width:1}}#{SVG_ID} .lg{{stroke:gray;stroke-width:1}}',
+    ]
+    out.append("".join(f'#{SVG_ID} .{k}{{fill:{v}}}' for k, v in CELL_COLORS.items()))
+    out.append('</style>')
+
+    out.append(f'<text class="b c" x="{_px(3.5)}" y="{_py(6.2)}" font-size="18">{esc(get_title_text(year, month, mode))}</text>')
+    for i, d in enumerate(WEEKDAYS_TEXT):
+        out.append(f'<text class="b c" x="{_px(i + 0.5)}" y="{_py(6 - 0.25)}" font-size="12">{d}</text>')
+
+    cell_w, cell_h = _SCALE, round(row_height * _SCALE, 1)
+    current_day = 1
+    for w in range(weeks):
+        vs_name = vs_schedule[w] if w < len(vs_schedule) else ""
+        if vs_name:
+            out.append(f'<text class="b c" x="{_px(-0.3)}" y="{_py(6 - 0.5 - w * row_height - row_height / 2)}" font-size="14">{esc(vs_name)}</text>')
+
+        for d_idx in range(7):
+            if w == 0 and d_idx < start_weekday: continue
+            if current_day > days_in_month: break
+
+            x, y_bot = d_idx, 6 - 0.5 - w * row_height - row_height
+            info = schedule[current_day]
+            cls = get_day_class(info, current_day in flap_set, current_day in weekend_set, r4_names)
+            out.append(f'<rect class="cell {cls}" x="{_px(x)}" y="{_py(y_bot + row_height)}" width="{cell_w}" height="{cell_h}"/>')
+
+            day_text = str(current_day)
+            if info.get('warning'): day_text += " (!)"
+            out.append(f'<text class="b" x="{_px(x + 0.05)}" y="{_py(y_bot + row_height - 0.05)}" dominant-baseline="hanging" font-size="10">{day_text}</text>')
+
+            l1, l2 = info['line1'], info['line2']
+            if info['type'] == 'single':
+                name_on_duty = l2 if l2 else l1
+                out.append(f'<text class="c" x="{_px(x + 0.5)}" y="{_py(y_bot + row_height / 2)}" font-size="16">{esc(str(name_on_duty))}</text>')
+            else:
+                out.append(f'<text class="c" x="{_px(x + 0.5)}" y="{_py(y_bot + row_height * 0.65)}" font-size="14">{esc(l1) if l1 else "-"}</text>')
+                out.append(f'<text class="c" x="{_px(x + 0.5)}" y="{_py(y_bot + row_height * 0.25)}" font-size="14">{esc(l2) if l2 else "-"}</text>')
+            current_day += 1
+
+    out.append(f'<text class="b" x="{_px(0.5)}" y="{_py(LEGEND_Y[0])}" font-size="12">底色說明：</text>')
+    for row, lx, cls, label in LEGEND_ITEMS:
+        ly = LEGEND_Y[row]
+        out.append(f'<rect class="lg {cls}" x="{_px(lx)}" y="{_py(ly + 0.15)}" width="{0.3 * _SCALE}" height="{0.3 * _SCALE}"/>')
+        out.append(f'<text x="{_px(lx + 0.4)}" y="{_py(ly)}" dominant-baseline="central" font-size="10">{esc(label)}</text>')
+
+    out.append('</svg>')
+    return "".join(out)
+
+
+def render_stats_html(stats, quotas, residents_data):
+    """
+    [新增] 公平性統計表 (HTML 預覽版，欄位與 plot_stats_table 相同)
+    """
+    columns = ["醫師", "職級", "總班數", "目標", "假日班", "單人班", "Flap班(二線)"]
+    th = "".join(f'<th style="background:{C_TEXT};color:#fff;padding:6px 10px">{c}</th>' for c in columns)
+    rows = []
+    for r in residents_data:
+        n = r['name']
+        s = stats[n]
+        values = [html.escape(n), r['rank'], s['count'], quotas[n], s['weekend_count'], s['single_count'], s['flap_count']]
+        rows.append("<tr>" + "".join(f'<td style="border:1px solid {C_LINE};padding:4px 10px;text-align:center">{v}</td>' for v in values) + "</tr>")
+    return (
+        '<div style="overflow-x:auto"><table style="border-collapse:collapse">'
+        f'<thead><tr>{th}</tr></thead><tbody>{"".join(rows)}</tbody></table></div>'
+    )
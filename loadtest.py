@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pyarrow as pa
+import websockets
+from streamlit import __version__ as streamlit_version
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+# --- 多人同時使用壓力測試 (全部在本機執行) ---
+# 啟動一個 streamlit server 跑 app.py，以 websocket 模擬 N 位總醫師同時操作：
+#   開啟頁面 → 生成班表 → 數次人工微調 → 下載 (PNG / zip)
+# 記錄各步驟 p50/p95/p99 延遲，以及 server process 的 CPU 與 RSS，輸出 JSON 報告供版本間比較。
+#
+#   python loadtest.py --sessions 1 5 10 --edits 3
+#   python loadtest.py --sessions 10 --compare loadtest_reports/舊版.json
+# 需要 websockets 套件 (新版 streamlit 已內含)，CPU/RSS 量測讀取 /proc，僅支援 Linux。
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STEPS = ['open', 'generate', 'edit', 'download']
+FINISHED = ForwardMsg.ScriptFinishedStatus.Value('FINISHED_SUCCESSFULLY')
+
+
+# --- 1. Server process 與資源量測 ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    cmd = [sys.executable, '-m', 'streamlit', 'run', os.path.join(APP_DIR, 'app.py'),
+           '--server.headless', 'true', '--server.port', str(port), '--server.address', '127.0.0.1',
+           '--browser.gatherUsageStats', 'false']
+    proc = subprocess.Popen(cmd, cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1) as r:
+                if r.status == 200: return proc
+        except OSError:
+            time.sleep(0.3)
+    proc.kill()
+    raise RuntimeError("streamlit server 無法啟動")
+
+
+class ProcessSampler(threading.Thread):
+    """
+    每 interval 秒讀取一次 /proc/<pid> 的 CPU 時間與 RSS (Linux)
+    """
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.page = os.sysconf('SC_PAGE_SIZE')
+        self.samples = []    # (time, cpu_seconds, rss_bytes)
+        self.running = True
+
+    def read(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{self.pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        return time.perf_counter(), (int(fields[11]) + int(fields[12])) / self.ticks, rss_pages * self.page
+
+    def run(self):
+        while self.running:
+            try: self.samples.append(self.read())
+            except (OSError, IndexError): break
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        try: self.samples.append(self.read())
+        except (OSError, IndexError): pass
+
+    def summary(self):
+        if len(self.samples) < 2: return {}
+        (t0, c0, _), (t1, c1, _) = self.samples[0], self.samples[-1]
+        cpu = [(b[1] - a[1]) / (b[0] - a[0]) * 100 for a, b in zip(self.samples, self.samples[1:]) if b[0] > a[0]]
+        rss = [s[2] for s in self.samples]
+        return {
+            'cpu_avg_pct': round((c1 - c0) / (t1 - t0) * 100, 1),
+            'cpu_peak_pct': round(max(cpu), 1) if cpu else None,
+            'cpu_seconds': round(c1 - c0, 2),
+            'rss_start_mb': round(rss[0] / 2**20, 1),
+            'rss_peak_mb': round(max(rss) / 2**20, 1),
+            'rss_end_mb': round(rss[-1] / 2**20, 1),
+        }
+
+
+# --- 2. 模擬一位使用者 (websocket session) ---
+
+class SimulatedSession:
+    def __init__(self, port):
+        self.port = port
+        self.ws = None
+        self.session_id = ''
+        self.elements = {}    # widget id -> element (本次 rerun 畫出的)
+
+    async def connect(self):
+        self.ws = await websockets.connect(f'ws://127.0.0.1:{self.port}/_stcore/stream',
+                                           subprotocols=['streamlit'], max_size=None)
+
+    async def close(self):
+        if self.ws: await self.ws.close()
+
+    async def _read(self):
+        f = ForwardMsg()
+        f.ParseFromString(await self.ws.recv())
+        kind = f.WhichOneof('type')
+        if kind == 'new_session':
+            self.session_id = f.new_session.initialize.session_id
+        elif kind == 'delta' and f.delta.WhichOneof('type') == 'new_element':
+            element = f.delta.new_element
+            sub = getattr(element, element.WhichOneof('type') or '', None)
+            if getattr(sub, 'id', ''): self.elements[sub.id] = sub
+        return f, kind
+
+    async def rerun(self, widget_states=()):
+        """
+        送出一次 rerun，等到 script 正常結束 (st.rerun() 中斷的那次不算)
+        """
+        self.elements = {}
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        for ws in widget_states: msg.rerun_script.widget_states.widgets.append(ws)
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            f, kind = await self._read()
+            if kind == 'script_finished' and f.script_finished == FINISHED: return
+
+    def find(self, type_name='', suffix='', label=''):
+        for wid, el in self.elements.items():
+            if type_name and el.DESCRIPTOR.name != type_name: continue
+            if suffix and not wid.endswith(suffix): continue
+            if label and label not in getattr(el, 'label', ''): continue
+            return el
+        return None
+
+    async def download(self, element):
+        msg = BackMsg()
+        req = msg.backend_operation_request
+        req.request_id = f'{id(self)}-{element.id}-{time.perf_counter_ns()}'
+        req.session_id = self.session_id
+        req.deferred_file.file_id = element.deferred_file_id
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            f, kind = await self._read()
+            if kind == 'backend_operation_response' and f.backend_operation_response.request_id == req.request_id:
+                break
+        resp = f.backend_operation_response
+        if resp.error_msg: raise RuntimeError(resp.error_msg)
+        url = f'http://127.0.0.1:{self.port}{resp.deferred_file.url}'
+        return await asyncio.to_thread(lambda: len(urllib.request.urlopen(url, timeout=120).read()))
+
+
+def _trigger(widget_id):
+    return WidgetState(id=widget_id, trigger_value=True)
+
+
+def _editor_cell(editor, row, column):
+    # 編輯器目前顯示的資料 (Arrow IPC)，每次 rerun 後都是最新班表
+    table = pa.ipc.open_stream(editor.arrow_data.data).read_all()
+    return table.column(column)[row].as_py() or ""
+
+
+def _editor_state(widget_id, row, column, value):
+    edits = {'edited_rows': {str(row): {column: value}}, 'added_rows': [], 'deleted_rows': []}
+    return WidgetState(id=widget_id, string_value=json.dumps(edits, ensure_ascii=False))
+
+
+async def run_user(port, edits, seed, timings, errors, step_timeout):
+    rng = random.Random(seed)
+    session = SimulatedSession(port)
+
+    async def timed(step, coro):
+        # 單一步驟卡住時視為錯誤並結束此 session，避免整個情境無限等待
+        t = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(coro, step_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"{step} 超過 {step_timeout:g} 秒未完成") from None
+        timings[step].append(time.perf_counter() - t)
+        return result
+
+    try:
+        await asyncio.wait_for(session.connect(), step_timeout)
+        await timed('open', session.rerun())
+
+        button = session.find('Button', label='生成班表')
+        await timed('generate', session.rerun([_trigger(button.id)]))
+
+        for _ in range(edits):
+            editor = session.find(suffix='-editor_key')
+            if editor is None: raise RuntimeError("找不到人工微調編輯器 (生成失敗？)")
+            row = rng.randrange(28)
+            column = rng.choice(["一線 (Line 1)", "二線 (Line 2)"])
+            # 選與目前不同的醫師，確保每次微調都真的觸發重算與 st.rerun()
+            current = _editor_cell(editor, row, column)
+            name = rng.choice([n for n in (f"醫師{k}" for k in range(1, 9)) if n != current])
+            await timed('edit', session.rerun([_editor_state(editor.id, row, column, name)]))
+
+        buttons = [el for el in session.elements.values()
+                   if el.DESCRIPTOR.name == 'DownloadButton' and el.deferred_file_id]
+        for el in buttons:
+            await timed('download', session.download(el))
+    except Exception as e:
+        errors.append(f'{type(e).__name__}: {e}')
+    finally:
+        await session.close()
+
+
+# --- 3. 情境執行與報告 ---
+
+def percentiles(values):
+    if not values: return {'count': 0}
+    v = sorted(values)
+    pick = lambda q: round(v[min(len(v) - 1, int(q * len(v)))] * 1000, 1)
+    return {'count': len(v), 'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': round(v[-1] * 1000, 1)}
+
+
+async def run_scenario(port, sessions, edits, ramp, seed, step_timeout):
+    timings = {step: [] for step in STEPS}
+    errors = []
+
+    async def delayed(i):
+        if ramp: await asyncio.sleep(ramp * i / max(1, sessions))
+        await run_user(port, edits, seed + i, timings, errors, step_timeout)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    return timings, errors, time.perf_counter() - start
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report, baseline=None):
+    base = {s['sessions']: s for s in (baseline or {}).get('scenarios', [])}
+    print(f"\n版本 {report['meta']['revision']} | streamlit {report['meta']['streamlit']} | CPU x{report['meta']['cpu_count']}")
+    print(f"{'人數':>4} {'步驟':<9} {'次數':>5} {'p50':>9} {'p95':>9} {'p99':>9}   {'CPU avg/peak %':>15} {'RSS peak MB':>12}")
+    for sc in report['scenarios']:
+        res = sc['resources']
+        for i, step in enumerate(STEPS):
+            lat = sc['latency'][step]
+            if not lat['count']: continue
+            line = f"{sc['sessions']:>4} {step:<9} {lat['count']:>5} {lat['p50_ms']:>9} {lat['p95_ms']:>9} {lat['p99_ms']:>9}"
+            if i == 0: line += f"   {res.get('cpu_avg_pct', '-'):>7}/{res.get('cpu_peak_pct', '-'):<7} {res.get('rss_peak_mb', '-'):>12}"
+            old = base.get(sc['sessions'], {}).get('latency', {}).get(step)
+            if old and old.get('count'):
+                line += f"   (p95 {lat['p95_ms'] - old['p95_ms']:+.1f} ms vs {baseline['meta']['revision']})"
+            print(line)
+        if sc['errors']: print(f"     錯誤 {len(sc['errors'])} 筆，例如：{sc['errors'][0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="排班系統多人同時使用壓力測試 (本機)")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10], help="各情境的同時使用人數")
+    parser.add_argument('--edits', type=int, default=3, help="每位使用者的人工微調次數")
+    parser.add_argument('--ramp', type=float, default=0.0, help="使用者在幾秒內陸續進入 (0 = 同時)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--step-timeout', type=float, default=120.0, help="單一步驟逾時秒數，逾時記為該 session 的錯誤")
+    parser.add_argument('--output', default=None, help="JSON 報告路徑 (預設 loadtest_reports/<版本>_<時間>.json)")
+    parser.add_argument('--compare', default=None, help="與先前的 JSON 報告比較 p95")
+    args = parser.parse_args()
+
+    port = _free_port()
+    server = start_server(port)
+    report = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'streamlit': streamlit_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'edits_per_session': args.edits,
+            'ramp_s': args.ramp,
+            'step_timeout_s': args.step_timeout,
+        },
+        'scenarios': [],
+    }
+    try:
+        # 暖身：載入字型、matplotlib 等 process 共用資源，不列入統計
+        asyncio.run(run_scenario(port, 1, 1, 0, args.seed, args.step_timeout))
+        for n in args.sessions:
+            sampler = ProcessSampler(server.pid)
+            sampler.start()
+            timings, errors, wall = asyncio.run(run_scenario(port, n, args.edits, args.ramp, args.seed, args.step_timeout))
+            sampler.stop()
+            report['scenarios'].append({
+                'sessions': n,
+                'wall_s': round(wall, 2),
+                'latency': {step: percentiles(timings[step]) for step in STEPS},
+                'resources': sampler.summary(),
+                'errors': errors,
+            })
+            print(f"完成 {n} 人情境：{wall:.1f} 秒，錯誤 {len(errors)} 筆")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    output = os.path.abspath(args.output or os.path.join(APP_DIR, 'loadtest_reports', f"{report['meta']['revision']}_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f: baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\n報告已寫入 {output}")
+
+
+if __name__ == '__main__':
+    main()
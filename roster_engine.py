@@ -0,0 +1,393 @@
+import calendar
+import pandas as pd
+import random
+
+# --- 核心排班引擎 (不依賴 Streamlit，供 app.py 與 roster_service.py 共用) ---
+
+def get_default_weekends(year, month):
+    start_weekday, days_in_month = calendar.monthrange(year, month)
+    return [d for d in range(1, days_in_month + 1) if (start_weekday + d - 1) % 7 >= 5]
+
+# --- 1. 核心排班邏輯 & 輔助計算函式 ---
+
+def recalculate_stats(schedule, residents_data, flap_dates, weekend_dates):
+    """
+    [新增] 當使用者手動修改表格後，重新計算所有統計數據
+    """
+    # 初始化
+    stats = {r['name']: {'count': 0, 'weekend_count': 0, 'single_count': 0, 'flap_count': 0} for r in residents_data}
+    
+    for d, info in schedule.items():
+        l1 = info['line1']
+        l2 = info['line2']
+        is_single = (info['type'] == 'single')
+        
+        # 統計 Line 1
+        if l1 and l1 in stats:
+            stats[l1]['count'] += 1
+            if d in weekend_dates: stats[l1]['weekend_count'] += 1
+            
+        # 統計 Line 2
+        if l2 and l2 in stats:
+            stats[l2]['count'] += 1
+            if d in weekend_dates: stats[l2]['weekend_count'] += 1
+            
+            # Flap 班統計 (定義：Flap 日擔任二線/單人值班者)
+            if d in flap_dates:
+                stats[l2]['flap_count'] += 1
+            
+            # 單人班統計 (定義：單人班的唯一值班者)
+            if is_single:
+                stats[l2]['single_count'] += 1
+                
+    return stats
+
+def calculate_standard_8_person_shifts(residents_data, num_days):
+    r3s = sorted([r for r in residents_data if r['rank'] == 'R3'], key=lambda x: x['name'])
+    r4s = sorted([r for r in residents_data if r['rank'] == 'R4'], key=lambda x: x['name'])
+    r5s = sorted([r for r in residents_data if r['rank'] == 'R5'], key=lambda x: x['name'])
+    r6s = sorted([r for r in residents_data if r['rank'] == 'R6'], key=lambda x: x['name'])
+
+    quotas = {r['name']: 0 for r in residents_data}
+    line1_pool = r3s + r4s 
+    line2_pool = r5s + r6s
+
+    def distribute_shifts(pool, total_slots):
+        if not pool: return
+        n = len(pool)
+        base_shifts = total_slots // n
+        remainder = total_slots % n
+        for i, r in enumerate(pool):
+            extra = 1 if i < remainder else 0
+            quotas[r['name']] = base_shifts + extra
+
+    distribute_shifts(line1_pool, num_days)
+    distribute_shifts(line2_pool, num_days)
+    return quotas
+
+def calculate_scenario_and_quotas(residents_data, num_days):
+    MAX_SHIFTS = 8
+    total_slots_needed_for_double = num_days * 2
+    
+    r6s = [r for r in residents_data if r['rank'] == 'R6']
+    r5s = [r for r in residents_data if r['rank'] == 'R5']
+    r4s = [r for r in residents_data if r['rank'] == 'R4']
+    r3s = [r for r in residents_data if r['rank'] == 'R3']
+    
+    is_standard_8 = (len(r6s)==2 and len(r5s)==2 and len(r4s)==2 and len(r3s)==2)
+    
+    strict_mode = False
+    quotas = {}
+    target_double_count = num_days
+    mode = ""
+
+    if is_standard_8:
+        mode = "Standard 8-Person (Strict Line Separation)"
+        strict_mode = True
+        target_double_count = num_days
+        quotas = calculate_standard_8_person_shifts(residents_data, num_days)
+    else:
+        total_supply = len(residents_data) * MAX_SHIFTS
+        quotas = {r['name']: MAX_SHIFTS for r in residents_data}
+        
+        if total_supply >= total_slots_needed_for_double:
+            mode = "Scenario A (Surplus)"
+            excess = total_supply - total_slots_needed_for_double
+            reduce_order = r6s + r5s + r4s + r3s
+            while excess > 0:
+                reduced = False
+                for r in reduce_order:
+                    name = r['name']
+                    if quotas[name] > 7 and excess > 0:
+                        quotas[name] -= 1
+                        excess -= 1
+                        reduced = True
+                if not reduced: break
+            target_double_count = num_days
+        else:
+            mode = "Scenario B/C (Shortage)"
+            senior_role_demand = num_days
+            senior_supply = (len(r5s) + len(r6s)) * MAX_SHIFTS
+            senior_deficit = max(0, senior_role_demand - senior_supply)
+            r4_total = len(r4s) * MAX_SHIFTS
+            r4_for_line1 = max(0, r4_total - senior_deficit)
+            r3_total = len(r3s) * MAX_SHIFTS
+            total_line1_capacity = r3_total + r4_for_line1
+            target_double_count = min(num_days, total_line1_capacity)
+
+    return quotas, target_double_count, mode, strict_mode
+
+def run_scheduler(year, month, residents_data, flap_dates, fixed_shifts, vs_schedule, custom_holidays):
+    
+    num_days = pd.Period(f'{year}-{month}').days_in_month
+    dates = range(1, num_days + 1)
+    weekend_dates = custom_holidays
+
+    seniors = [r['name'] for r in residents_data if r['rank'] in ['R5', 'R6']]
+    r4s = [r['name'] for r in residents_data if r['rank'] == 'R4']
+    r3s = [r['name'] for r in residents_data if r['rank'] == 'R3']
+    all_names = [r['name'] for r in residents_data]
+    res_dict = {r['name']: r for r in residents_data}
+    
+    is_extreme_mode = (len(residents_data) <= 6)
+
+    quotas, target_double_count, mode_desc, strict_mode = calculate_scenario_and_quotas(residents_data, num_days)
+    
+    # 極限模式彈性
+    if is_extreme_mode:
+        for name in quotas: quotas[name] += 1 
+
+    # 計算 Credits
+    if is_extreme_mode:
+        r3_shifts = len(r3s) * 8
+        r4_shifts = len(r4s) * 8
+        senior_demand = num_days
+        senior_supply = len(seniors) * 8
+        r4_support_line2 = max(0, senior_demand - senior_supply) 
+        r4_for_line1 = max(0, r4_shifts - r4_support_line2)
+        real_double_credits = r3_shifts + r4_for_line1
+        target_double_count = min(num_days, real_double_credits)
+
+    locked_junior_dates = set()
+    for name, locked_days in fixed_shifts.items():
+        if res_dict[name]['rank'] in ['R3', 'R4']:
+            for d in locked_days: locked_junior_dates.add(d)
+
+    # --- Monte Carlo 模擬 ---
+    for attempt in range(5000):
+        schedule = {d: {'line1': None, 'line2': None, 'type': 'single', 'warning': ''} for d in dates}
+        res_state = {name: {'count': 0, 'dates': [], 'weekend_count': 0, 'single_count': 0, 'flap_count': 0} for name in all_names}
+        possible = True
+        
+        # 配額分配
+        current_credits = target_double_count
+        double_days = set()
+        
+        for d in locked_junior_dates:
+            double_days.add(d)
+            if current_credits > 0: current_credits -= 1
+
+        pool_flap = [d for d in dates if d in flap_dates and d not in double_days]
+        pool_holiday = [d for d in dates if d in weekend_dates and d not in flap_dates and d not in double_days]
+        pool_weekday = [d for d in dates if d not in flap_dates and d not in weekend_dates and d not in double_days]
+        
+        random.shuffle(pool_flap)
+        random.shuffle(pool_holiday)
+        random.shuffle(pool_weekday)
+        
+        priority_list = pool_flap + pool_holiday + pool_weekday    
+        for d in priority_list:
+            if current_credits > 0:
+                double_days.add(d)
+                current_credits -= 1
+        
+        for d in dates:
+            if d in double_days: schedule[d]['type'] = 'double'
+            else: schedule[d]['type'] = 'single'
+
+        # Check Availability Helper
+        def is_available(name, day, strict_consecutive=True, strict_quota=True):
+            if day in res_dict[name]['unavailable']: return False
+            if day in res_state[name]['dates']: return False 
+            if strict_quota and res_state[name]['count'] >= quotas[name]: return False
+            if strict_consecutive:
+                if (day - 1) in res_state[name]['dates']: return False 
+                if (day + 1) in res_state[name]['dates']: return False
+            return True
+
+        # Phase 1: Fixed Shifts
+        fixed_items = list(fixed_shifts.items())
+        random.shuffle(fixed_items)
+        for p_name, p_dates in fixed_items:
+            rank = res_dict[p_name]['rank']
+            for d in p_dates:
+                if d not in res_state[p_name]['dates']:
+                    res_state[p_name]['count'] += 1
+                    res_state[p_name]['dates'].append(d)
+                    if d in weekend_dates: res_state[p_name]['weekend_count'] += 1
+                
+                is_single = (schedule[d]['type'] == 'single')
+                if rank == 'R3':
+                    schedule[d]['line1'] = p_name
+                    if is_single: schedule[d]['type'] = 'double'
+                elif rank in ['R5', 'R6']:
+                    schedule[d]['line2'] = p_name
+                elif rank == 'R4':
+                    if is_single: schedule[d]['line2'] = p_name
+                    else:
+                        if schedule[d]['line1']: schedule[d]['line2'] = p_name
+                        else: schedule[d]['line1'] = p_name
+
+        # Phase 2: Fill Line 2
+        senior_slots = []
+        for d in dates:
+            if schedule[d]['line2'] is None:
+                is_flap = d in flap_dates
+                is_weekend = d in weekend_dates
+                priority = 0
+                if is_extreme_mode:
+                    if is_weekend: priority = 200 
+                    elif is_flap: priority = 100
+                    else: priority = 10
+                else:
+                    if is_flap: priority = 100
+                    elif is_weekend: priority = 50
+                    else: priority = 10
+                senior_slots.append((d, priority))
+        
+        senior_slots.sort(key=lambda x: x[1], reverse=True)
+        
+        for d, prio in senior_slots:
+            pool = []
+            if strict_mode and not is_extreme_mode: pool = seniors
+            else: pool = seniors + r4s
+            l1 = schedule[d]['line1']
+            current_pool = [p for p in pool if p != l1]
+
+            cands = [p for p in current_pool if is_available(p, d, True, True)]
+            if not cands:
+                cands = [p for p in current_pool if is_available(p, d, False, True)]
+                if cands: schedule[d]['warning'] += '連值 '
+            if not cands:
+                cands = [p for p in current_pool if is_available(p, d, True, False)]
+                if cands: schedule[d]['warning'] += '超班 '
+            if not cands:
+                cands = [p for p in current_pool if is_available(p, d, False, False)]
+                if cands: schedule[d]['warning'] += '連值+超班 '
+
+            if cands:
+                def get_p2_key(n):
+                    rank = res_dict[n]['rank']
+                    st_score = 10
+                    if is_extreme_mode:
+                        if (d in weekend_dates): st_score = 0 if rank=='R4' else 1
+                        elif (d in flap_dates): st_score = 0 if rank in ['R5','R6'] else 1
+                        else: st_score = 0 if rank in ['R5','R6'] else 1
+                    else: st_score = 0 if rank in ['R5','R6'] else 1
+                    return (st_score, res_state[n]['count'], random.random())
+                
+                cands.sort(key=get_p2_key)
+                best = cands[0]
+                schedule[d]['line2'] = best
+                res_state[best]['count'] += 1
+                res_state[best]['dates'].append(d)
+                if d in weekend_dates: res_state[best]['weekend_count'] += 1
+            else:
+                possible = False; break
+
+        if not possible: continue
+
+        # Phase 3: Fill Line 1
+        junior_slots = [d for d in dates if schedule[d]['type'] == 'double' and schedule[d]['line1'] is None]
+        junior_slots.sort(key=lambda x: (0 if x in flap_dates else 1, 0 if x in weekend_dates else 1))
+        
+        for d in junior_slots:
+            pool = r3s + r4s
+            l2 = schedule[d]['line2']
+            current_pool = [p for p in pool if p != l2]
+            
+            cands = [p for p in current_pool if is_available(p, d, True, True)]
+            if not cands:
+                cands = [p for p in current_pool if is_available(p, d, False, True)]
+                if cands: schedule[d]['warning'] += 'L1連值 '
+            if not cands:
+                cands = [p for p in current_pool if is_available(p, d, True, False)]
+                 
+            if cands:
+                cands.sort(key=lambda n: (res_state[n]['count'], random.random()))
+                best = cands[0]
+                schedule[d]['line1'] = best
+                res_state[best]['count'] += 1
+                res_state[best]['dates'].append(d)
+                if d in weekend_dates: res_state[best]['weekend_count'] += 1
+            else:
+                schedule[d]['type'] = 'single'
+                if 'L1連值' in schedule[d]['warning']: schedule[d]['warning'] = schedule[d]['warning'].replace('L1連值', '')
+
+        # Phase 4: Smart Rebalance
+        target_shift_per_person = 8
+        over_seniors = [n for n in seniors if res_state[n]['count'] > target_shift_per_person]
+        under_r4s = [n for n in r4s if res_state[n]['count'] < target_shift_per_person]
+        
+        if over_seniors and under_r4s:
+            swap_candidates = []
+            for d in dates:
+                l2 = schedule[d]['line2']
+                if l2 in over_seniors and d not in weekend_dates and d not in fixed_shifts.get(l2, ()):
+                    priority = 0
+                    if d in flap_dates: priority = 10 
+                    elif schedule[d]['type'] == 'single': priority = 5 
+                    else: priority = 1
+                    swap_candidates.append((d, l2, priority))
+            
+            swap_candidates.sort(key=lambda x: x[2], reverse=True)
+            
+            for d, senior_name, prio in swap_candidates:
+                under_r4s = [n for n in r4s if res_state[n]['count'] < target_shift_per_person]
+                if not under_r4s: break
+                valid_r4 = [r for r in under_r4s if is_available(r, d, True, False) and r != schedule[d]['line1']]
+                if valid_r4 and res_state[senior_name]['count'] > target_shift_per_person:
+                    r4_name = valid_r4[0]
+                    schedule[d]['line2'] = r4_name
+                    res_state[senior_name]['count'] -= 1
+                    res_state[senior_name]['dates'].remove(d)
+                    res_state[r4_name]['count'] += 1
+                    res_state[r4_name]['dates'].append(d)
+
+        under_r3s = [n for n in r3s if res_state[n]['count'] < target_shift_per_person]
+        if under_r3s:
+            single_days = [d for d in dates if schedule[d]['type'] == 'single']
+            single_days.sort(key=lambda x: 10 if x in flap_dates else 1, reverse=True)
+            for d in single_days:
+                under_r3s = [n for n in r3s if res_state[n]['count'] < target_shift_per_person]
+                if not under_r3s: break
+                l2 = schedule[d]['line2']
+                valid_r3 = [r for r in under_r3s if is_available(r, d, True, False) and r != l2]
+                if valid_r3:
+                    r3_name = valid_r3[0]
+                    schedule[d]['line1'] = r3_name
+                    schedule[d]['type'] = 'double'
+                    res_state[r3_name]['count'] += 1
+                    res_state[r3_name]['dates'].append(d)
+                    if d in weekend_dates: res_state[r3_name]['weekend_count'] += 1
+
+        # 最終統計 (初次)
+        stats = recalculate_stats(schedule, residents_data, flap_dates, weekend_dates)
+        return schedule, stats, mode_desc, quotas
+
+    return None, None, None, None
+
+# --- 2. 生成報告 ---
+
+def generate_logic_report(year, month, schedule, stats, mode, quotas, residents_data, flap_dates, weekend_dates):
+    lines = []
+    lines.append(f"【智能排班邏輯說明報告】 {year}年{month}月")
+    lines.append("="*40)
+    
+    single_count = sum(1 for d in schedule if schedule[d]['type'] == 'single')
+    
+    lines.append(f"1. 判斷場景：{mode}")
+    if "Standard 8-Person" in mode:
+        lines.append(f"   - 啟動【8人標準模式】：嚴格執行職級分流。")
+        lines.append(f"   - 一線班(Line 1)：僅由 R3、R4 擔任。")
+        lines.append(f"   - 二線班(Line 2)：僅由 R5、R6 擔任。")
+        lines.append(f"   - 班數分配：資淺者(R3, R5)優先承擔剩餘班數(例如30天=R6七班+R5八班)。")
+    elif single_count > 0:
+        lines.append(f"   - 因人力結構限制，本月安排 {single_count} 天單人值班。")
+        lines.append(f"   - 單人班已依照痛苦程度 (Flap單人 > 假日單人 > 平日單人) 盡量避免高痛點。")
+    else:
+        lines.append(f"   - 人力充足，全月雙人值班。")
+    
+    lines.append(f"\n2. 醫師目標班數：")
+    for r in residents_data:
+        lines.append(f"   - {r['name']}: 目標 {quotas[r['name']]} 班 | 實際 {stats[r['name']]['count']} 班")
+    
+    lines.append(f"\n3. 公平性數據 (Flap班僅統計二線/單人)：")
+    lines.append(f"   {'醫師':<6} {'總班':<4} {'假日':<4} {'單人':<4} {'Flap':<4}")
+    lines.append("-" * 40)
+    for r in residents_data:
+        n = r['name']
+        s = stats[n]
+        lines.append(f"   {n:<6} {s['count']:<4} {s['weekend_count']:<4} {s['single_count']:<4} {s['flap_count']:<4}")
+
+    return "\n".join(lines)
@@ -0,0 +1,203 @@
+import csv
+import datetime
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+# --- 班表匯出 (ICS 個人行事曆 / XLSX / CSV 全科總表) ---
+# 直接由 schedule dict 產生，不經過 matplotlib。
+# rosters 為 (year, month, schedule, flap_dates, weekend_dates) 的序列，
+# 可只放當月，也可一次放入整年 12 個月。
+
+WEEKDAY_TEXT = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+COLUMNS = ["日期", "星期", "班別", "一線 (Line 1)", "二線 (Line 2)", "假日", "Flap", "備註"]
+
+
+def iter_duty_rows(rosters):
+    """
+    逐日展開班表，每列為 (date, type, line1, line2, is_holiday, is_flap, warning)
+    """
+    for year, month, schedule, flap_dates, weekend_dates in rosters:
+        flap_set, weekend_set = set(flap_dates), set(weekend_dates)
+        for d in sorted(schedule):
+            info = schedule[d]
+            yield (
+                datetime.date(year, month, d),
+                info['type'],
+                info['line1'] or "",
+                info['line2'] or "",
+                d in weekend_set,
+                d in flap_set,
+                (info.get('warning') or "").strip(),
+            )
+
+
+def _row_texts(row):
+    dt, shift_type, l1, l2, is_holiday, is_flap, warning = row
+    return [
+        dt.isoformat(),
+        WEEKDAY_TEXT[dt.weekday()],
+        "雙人" if shift_type == 'double' else "單人",
+        l1, l2,
+        "Y" if is_holiday else "",
+        "Y" if is_flap else "",
+        warning,
+    ]
+
+
+# --- CSV ---
+
+def write_csv(stream, rows):
+    # 加上 BOM，Excel 開啟時中文才不會亂碼
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='', write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(_row_texts(row))
+    text.detach()
+
+
+# --- XLSX (最小 SpreadsheetML，逐列寫出，不需 openpyxl) ---
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="班表" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(row_idx, values):
+    cells = "".join(
+        f'<c r="{chr(65 + i)}{row_idx}" t="inlineStr"><is><t>{escape(v)}</t></is></c>'
+        for i, v in enumerate(values) if v != ""
+    )
+    return f'<row r="{row_idx}">{cells}</row>'
+
+
+def write_xlsx(stream, rows):
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as xz:
+        xz.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        xz.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        xz.writestr('xl/workbook.xml', _XLSX_WORKBOOK)
+        xz.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        with xz.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, COLUMNS).encode('utf-8'))
+            for i, row in enumerate(rows, start=2):
+                sheet.write(_xlsx_row(i, _row_texts(row)).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+
+
+# --- ICS (RFC 5545，每位醫師一個檔案) ---
+
+def _ics_escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_line(line):
+    # 超過 75 bytes 需折行 (續行以空白開頭)，且不可切斷 UTF-8 字元
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return data + b'\r\n'
+    out, chunk, limit = [], b'', 75
+    for ch in line:
+        b = ch.encode('utf-8')
+        if len(chunk) + len(b) > limit:
+            out.append(chunk)
+            chunk, limit = b' ', 75
+        chunk += b
+    out.append(chunk)
+    return b'\r\n'.join(out) + b'\r\n'
+
+
+def write_ics(stream, name, duties, stamp):
+    """
+    duties: [(date, role, partner, is_single)]，role 為 'line1' / 'line2'
+    """
+    stream.write(_ics_line('BEGIN:VCALENDAR'))
+    stream.write(_ics_line('VERSION:2.0'))
+    stream.write(_ics_line('PRODID:-//duty-roster//NCKU PRS//ZH-TW'))
+    stream.write(_ics_line('CALSCALE:GREGORIAN'))
+    stream.write(_ics_line(f'X-WR-CALNAME:{_ics_escape(name)} 值班'))
+    for dt, role, partner, is_single in duties:
+        if is_single: summary = "值班 (單人)"
+        elif role == 'line1': summary = "值班 一線"
+        else: summary = "值班 二線"
+        if partner: summary += f" / 搭檔 {partner}"
+        stream.write(_ics_line('BEGIN:VEVENT'))
+        stream.write(_ics_line(f'UID:{dt.strftime("%Y%m%d")}-{role}-{name.encode("utf-8").hex()}@duty-roster'))
+        stream.write(_ics_line(f'DTSTAMP:{stamp}'))
+        stream.write(_ics_line(f'DTSTART;VALUE=DATE:{dt.strftime("%Y%m%d")}'))
+        stream.write(_ics_line(f'DTEND;VALUE=DATE:{(dt + datetime.timedelta(days=1)).strftime("%Y%m%d")}'))
+        stream.write(_ics_line(f'SUMMARY:{_ics_escape(summary)}'))
+        stream.write(_ics_line('TRANSP:OPAQUE'))
+        stream.write(_ics_line('END:VEVENT'))
+    stream.write(_ics_line('END:VCALENDAR'))
+
+
+def _safe_filename(name):
+    return "".join('_' if ch in '\\/:*?"<>|' else ch for ch in name).strip() or "resident"
+
+
+# --- 打包 ---
+
+def write_export_zip(fileobj, rosters, residents_data, label):
+    """
+    走訪 rosters 一次展開成逐日列表，同一份列表寫出 CSV、XLSX 與每位醫師的 ICS。
+    逐日列表與每位醫師的值班清單都保留在記憶體中 (一整年約 365 列)；
+    build_export_zip 另將整個 zip 組在 BytesIO 中再回傳 bytes。
+    """
+    rows = list(iter_duty_rows(rosters))
+    duties = {r['name']: [] for r in residents_data}
+    for dt, shift_type, l1, l2, _, _, _ in rows:
+        is_single = (shift_type == 'single') or not (l1 and l2)
+        if l1 in duties: duties[l1].append((dt, 'line1', l2, is_single))
+        if l2 in duties: duties[l2].append((dt, 'line2', l1, is_single))
+
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(f'schedule_{label}.csv', 'w') as f:
+            write_csv(f, rows)
+        # xlsx 本身即為 zip，內層不再壓縮
+        with zf.open(zipfile.ZipInfo(f'schedule_{label}.xlsx', date_time=datetime.datetime.now().timetuple()[:6]), 'w') as f:
+            write_xlsx(f, rows)
+        used = set()
+        for name, items in duties.items():
+            fname = _safe_filename(name)
+            while fname in used: fname += '_'
+            used.add(fname)
+            with zf.open(f'ics/{fname}_{label}.ics', 'w') as f:
+                write_ics(f, name, items, stamp)
+    return fileobj
+
+
+def build_export_zip(rosters, residents_data, label):
+    buf = io.BytesIO()
+    write_export_zip(buf, rosters, residents_data, label)
+    return buf.getvalue()
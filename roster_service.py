@@ -0,0 +1,475 @@
+import argparse
+import calendar
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import roster_engine
+from roster_export import build_export_zip, _safe_filename
+
+# --- 本機排班 HTTP/JSON 服務 ---
+# 讓其他院內工具不經 Streamlit 直接呼叫排班引擎：
+#   python roster_service.py --port 8502 --workers 4 --queue 16 --timeout 30
+#
+#   POST /generate  產生班表            POST /repair  修正違規後重排空位
+#   POST /stats     重算統計與說明報告   POST /export  下載 ICS/XLSX/CSV zip
+#   GET  /health    GET /metrics (吞吐量、p50/p95/p99 延遲 (含 422/504 失敗)、佇列、快取)
+
+MAX_BODY_BYTES = 1 << 20
+YEAR_RANGE = (2000, 2100)
+RANKS = ('R3', 'R4', 'R5', 'R6')
+LINE_RANKS = {'line1': ('R3', 'R4'), 'line2': ('R4', 'R5', 'R6')}   # 各線可排的職級 (R4 可跨級補二線)
+
+
+class RequestError(ValueError):
+    status = 400
+
+
+class ServiceBusy(RuntimeError):
+    status = 503
+
+
+# --- 1. 請求解析 (在 HTTP thread 執行，錯誤直接回 400) ---
+
+def _is_int(value):
+    # JSON 的 true / false 在 Python 是 bool (int 的子類別)，需排除
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _day_list(value, days_in_month, field):
+    if value is None: return []
+    if not isinstance(value, list) or not all(_is_int(d) and 1 <= d <= days_in_month for d in value):
+        raise RequestError(f"{field} 必須是 1~{days_in_month} 的整數陣列")
+    return sorted(set(value))
+
+
+def parse_month(body):
+    if not isinstance(body, dict): raise RequestError("月份資料需為 JSON 物件")
+    year, month = body.get('year'), body.get('month')
+    if not _is_int(year) or not _is_int(month) or not YEAR_RANGE[0] <= year <= YEAR_RANGE[1] or not 1 <= month <= 12:
+        raise RequestError(f"year / month 格式錯誤 (year 需為 {YEAR_RANGE[0]}~{YEAR_RANGE[1]}，month 需為 1~12)")
+    days_in_month = calendar.monthrange(year, month)[1]
+    flap_dates = _day_list(body.get('flap_dates'), days_in_month, 'flap_dates')
+    if body.get('holidays') is None: holidays = roster_engine.get_default_weekends(year, month)
+    else: holidays = _day_list(body.get('holidays'), days_in_month, 'holidays')
+    return {'year': year, 'month': month, 'days': days_in_month, 'flap_dates': flap_dates, 'holidays': holidays}
+
+
+def parse_residents(body, days_in_month):
+    raw = body.get('residents')
+    if not isinstance(raw, list) or not raw:
+        raise RequestError("residents 不可為空")
+    residents = []
+    for r in raw:
+        if not isinstance(r, dict) or not isinstance(r.get('name'), str) or r.get('rank') not in RANKS:
+            raise RequestError("residents 每筆需有 name 與 rank (R3~R6)")
+        if not r['name'] or r['name'] != r['name'].strip():
+            raise RequestError("residents 姓名不可為空，前後不可有空白")
+        residents.append({'name': r['name'], 'rank': r['rank'],
+                          'unavailable': _day_list(r.get('unavailable'), days_in_month, 'unavailable')})
+    if len({r['name'] for r in residents}) != len(residents):
+        raise RequestError("residents 姓名不可重複")
+    return residents
+
+
+def parse_schedule(raw, days_in_month, names):
+    """
+    schedule 格式與 /generate 輸出相同：{"1": {"line1": "...", "line2": "..."}, ...}
+    班別依人數自動判斷 (同人工微調編輯器)
+    """
+    if not isinstance(raw, dict) or len(raw) != days_in_month:
+        raise RequestError(f"schedule 需包含 1~{days_in_month} 每一天")
+    schedule = {}
+    for key, info in raw.items():
+        try: d = int(key)
+        except ValueError: raise RequestError(f"schedule 日期錯誤：{key}")
+        if not 1 <= d <= days_in_month or not isinstance(info, dict):
+            raise RequestError(f"schedule 日期錯誤：{key}")
+        l1, l2 = info.get('line1') or None, info.get('line2') or None
+        for n in (l1, l2):
+            if n is not None and (not isinstance(n, str) or n not in names):
+                raise RequestError(f"schedule 第 {d} 天出現名單外的醫師：{n}")
+        schedule[d] = {'line1': l1, 'line2': l2, 'type': 'double' if (l1 and l2) else 'single',
+                       'warning': str(info.get('warning') or '')}
+    return dict(sorted(schedule.items()))
+
+
+def parse_label(value, default):
+    """
+    label 會成為 zip 內的檔名與 Content-Disposition，只接受可直接當檔名的文字
+    (可含中文，不可含路徑符號、控制字元或 ..)
+    """
+    if value is None or value == '': return default
+    if (not isinstance(value, str) or len(value) > 64 or value != _safe_filename(value)
+            or '..' in value or not value.isprintable()):
+        raise RequestError('label 需為 64 字以內的檔名文字，不可含 \\ / : * ? " < > |、控制字元或 ..')
+    return value
+
+
+def parse_request(endpoint, body):
+    if not isinstance(body, dict): raise RequestError("請求內容需為 JSON 物件")
+
+    if endpoint == 'export' and 'months' in body:
+        months = body['months']
+        if not isinstance(months, list) or not months: raise RequestError("months 不可為空")
+        parsed = [parse_month(m) for m in months]
+        residents = parse_residents(body, 31)
+        names = {r['name'] for r in residents}
+        for m, raw in zip(parsed, months):
+            m['schedule'] = parse_schedule(raw.get('schedule'), m['days'], names)
+        years = {m['year'] for m in parsed}
+        label = str(years.pop()) if len(years) == 1 and len(parsed) == 12 else f"{parsed[0]['year']}_{parsed[0]['month']}"
+        return {'residents': residents, 'months': parsed, 'label': parse_label(body.get('label'), label)}
+
+    req = parse_month(body)
+    req['residents'] = parse_residents(body, req['days'])
+    names = {r['name'] for r in req['residents']}
+    vs_schedule = body.get('vs_schedule') or []
+    if not isinstance(vs_schedule, list) or not all(isinstance(v, str) for v in vs_schedule):
+        raise RequestError("vs_schedule 需為字串陣列")
+    req['vs_schedule'] = vs_schedule
+
+    if endpoint == 'generate':
+        fixed = body.get('fixed_shifts') or {}
+        if not isinstance(fixed, dict) or not set(fixed) <= names:
+            raise RequestError("fixed_shifts 需為 {醫師姓名: [日期]}")
+        req['fixed_shifts'] = {n: _day_list(v, req['days'], 'fixed_shifts') for n, v in fixed.items() if v}
+        seed = body.get('seed')
+        if seed is not None and not _is_int(seed): raise RequestError("seed 需為整數")
+        req['seed'] = seed
+    else:
+        req['schedule'] = parse_schedule(body.get('schedule'), req['days'], names)
+        if endpoint == 'stats':
+            quotas = body.get('quotas')
+            if quotas is not None and (not isinstance(quotas, dict) or set(quotas) != names
+                                       or not all(_is_int(q) and q >= 0 for q in quotas.values())):
+                raise RequestError("quotas 需為 {醫師姓名: 目標班數}，且涵蓋所有醫師")
+            req['mode'] = str(body.get('mode') or '')
+            req['quotas'] = quotas
+
+    if endpoint == 'export':
+        return {'residents': req['residents'], 'months': [req], 'label': parse_label(body.get('label'), f"{req['year']}_{req['month']}")}
+    return req
+
+
+# --- 2. 排班工作 (在 worker process 執行) ---
+
+def _schedule_json(schedule):
+    return {str(d): info for d, info in schedule.items()}
+
+
+def _generate(req, fixed_shifts, seed=None):
+    # worker process 會重複使用，未指定 seed 時需重新取亂數種子，不沿用上一個工作的狀態
+    random.seed(seed)
+    schedule, stats, mode, quotas = roster_engine.run_scheduler(
+        req['year'], req['month'], req['residents'], req['flap_dates'],
+        fixed_shifts, req['vs_schedule'], req['holidays']
+    )
+    if not schedule: return None
+    report = roster_engine.generate_logic_report(
+        req['year'], req['month'], schedule, stats, mode, quotas,
+        req['residents'], req['flap_dates'], req['holidays']
+    )
+    return {'schedule': _schedule_json(schedule), 'stats': stats, 'mode': mode, 'quotas': quotas, 'report': report}
+
+
+def job_generate(req):
+    result = _generate(req, req['fixed_shifts'], req['seed'])
+    if result is None: return {'error': "排班失敗。請確認是否鎖定日期衝突過多。", 'status': 422}
+    return result
+
+
+def job_repair(req):
+    """
+    保留合法的人工排班，剔除違規者 (休假日、職級不符、同日一二線同人、連值)，其餘空位交由排班引擎重排。
+    排班引擎依職級決定指定班的位置，若仍有保留的班被同日其他指定班覆蓋，也一併列入 dropped。
+    """
+    unavailable = {r['name']: set(r['unavailable']) for r in req['residents']}
+    rank = {r['name']: r['rank'] for r in req['residents']}
+    kept, kept_roles, dropped = {}, {}, []
+    for d, info in req['schedule'].items():
+        for role in ('line2', 'line1'):
+            n = info[role]
+            if not n: continue
+            reason = None
+            if d in unavailable[n]: reason = "休假/預約不值班"
+            elif rank[n] not in LINE_RANKS[role]: reason = f"{rank[n]} 不可排{'一' if role == 'line1' else '二'}線"
+            elif role == 'line1' and n == info['line2']: reason = "同日一二線同人"
+            elif kept.get(n) and kept[n][-1] == d - 1: reason = "連值"
+            if reason:
+                dropped.append({'day': d, 'role': role, 'name': n, 'reason': reason})
+            else:
+                kept.setdefault(n, []).append(d)
+                kept_roles[(d, n)] = role
+
+    result = _generate(req, kept)
+    if result is None: return {'error': "無法修復此班表，請減少指定班或休假衝突。", 'status': 422}
+    for (d, n), role in kept_roles.items():
+        info = result['schedule'][str(d)]
+        if n not in (info['line1'], info['line2']):
+            dropped.append({'day': d, 'role': role, 'name': n, 'reason': "與同日其他指定班衝突"})
+    result['dropped'] = sorted(dropped, key=lambda x: (x['day'], x['role'] != 'line1'))
+    return result
+
+
+def job_stats(req):
+    """
+    重算統計；mode / quotas 未提供時依人力結構重新判斷 (同 run_scheduler 的場景判斷)
+    """
+    stats = roster_engine.recalculate_stats(req['schedule'], req['residents'], req['flap_dates'], req['holidays'])
+    quotas, _, mode, _ = roster_engine.calculate_scenario_and_quotas(req['residents'], req['days'])
+    quotas = req['quotas'] or quotas
+    mode = req['mode'] or mode
+    report = roster_engine.generate_logic_report(
+        req['year'], req['month'], req['schedule'], stats, mode, quotas,
+        req['residents'], req['flap_dates'], req['holidays']
+    )
+    return {'stats': stats, 'mode': mode, 'quotas': quotas, 'report': report}
+
+
+def job_export(req):
+    rosters = [(m['year'], m['month'], m['schedule'], m['flap_dates'], m['holidays']) for m in req['months']]
+    return build_export_zip(rosters, req['residents'], req['label'])
+
+
+JOBS = {'generate': job_generate, 'repair': job_repair, 'stats': job_stats, 'export': job_export}
+
+
+# --- 3. Worker pool + 有上限的佇列 + 結果快取 ---
+
+class RosterService:
+    def __init__(self, workers=4, queue_size=16, timeout=30.0, cache_size=256):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        self.cache_size = cache_size
+        # worker 會在 HTTP handler thread 中按需建立，多執行緒下 fork 不安全，改用 forkserver
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'))
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.inflight = {}
+        self.waiters = collections.Counter()    # 每個執行中工作正在等待結果的請求數
+        self.sequence = itertools.count()
+        self.started = time.time()
+        self.latency = {name: collections.deque(maxlen=4096) for name in JOBS}    # 最近 4096 筆，供分位數
+        self.completed = collections.Counter()    # 累計完成數，供吞吐量
+        self.failed = collections.Counter()
+        self.counters = collections.Counter()
+
+    def _key(self, endpoint, req):
+        # /generate、/repair 的結果帶亂數，未指定 seed 時 (/repair 不接受 seed) 不快取也不共用，每次重新計算
+        if endpoint in ('generate', 'repair') and req.get('seed') is None:
+            return None
+        raw = json.dumps(req, sort_keys=True, ensure_ascii=False, default=list)
+        return endpoint + ':' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _on_done(self, key, cacheable, future):
+        with self.lock:
+            self.inflight.pop(key, None)
+            if cacheable and not future.cancelled() and future.exception() is None:
+                self.cache[key] = future.result()
+                while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+
+    def submit(self, endpoint, req):
+        """
+        同樣的請求優先回傳快取，或共用執行中的結果；
+        執行中 + 排隊中的工作達上限時直接拒絕 (503)，不無限堆積。
+        回傳 (結果, 是否來自快取)。
+        逾時 (FutureTimeout) 時，若工作仍在排隊且沒有其他請求在等，會取消以釋出名額；
+        已在 worker 中執行的工作無法中斷，會繼續佔用名額直到完成。
+        """
+        key = self._key(endpoint, req)
+        cacheable = key is not None
+        is_new = False
+        with self.lock:
+            if not cacheable:
+                key = f'{endpoint}#{next(self.sequence)}'
+            elif key in self.cache:
+                self.cache.move_to_end(key)
+                self.counters['cache_hit'] += 1
+                return self.cache[key], True
+            future = self.inflight.get(key)
+            if future is None:
+                if len(self.inflight) >= self.capacity:
+                    self.counters['rejected'] += 1
+                    raise ServiceBusy("服務忙碌中，請稍後再試")
+                future = self.pool.submit(JOBS[endpoint], req)
+                self.inflight[key] = future
+                is_new = True
+            else:
+                self.counters['coalesced'] += 1
+            self.waiters[key] += 1
+        # 工作若已完成，callback 會在本 thread 立即執行，因此須在釋放 lock 後才註冊
+        if is_new: future.add_done_callback(lambda f, key=key: self._on_done(key, cacheable, f))
+        try:
+            return future.result(timeout=self.timeout), False
+        except FutureTimeout:
+            with self.lock:
+                shared = self.waiters[key] > 1
+            if not shared and future.cancel():
+                self.counters['cancelled'] += 1
+            raise
+        finally:
+            with self.lock:
+                self.waiters[key] -= 1
+                if self.waiters[key] <= 0: del self.waiters[key]
+
+    def record(self, endpoint, status, seconds, computed=False):
+        """
+        所有回應都計入狀態碼計數。延遲分位數與吞吐量只統計送進 worker pool 的請求，
+        不論成功 (200) 或失敗 (422 排班失敗、500、504 逾時)，逾時的長尾因此會反映在 p95/p99；
+        快取命中與未進 pool 的 400/411/413/503 不計入。
+        """
+        with self.lock:
+            self.counters[f'status_{status}'] += 1
+            if computed and endpoint in self.latency:
+                self.latency[endpoint].append(seconds)
+                self.completed[endpoint] += 1
+                if status != 200: self.failed[endpoint] += 1
+
+    def metrics(self):
+        def pct(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2) if values else None
+
+        with self.lock:
+            uptime = time.time() - self.started
+            done = sum(self.completed.values())
+            result = {
+                'uptime_s': round(uptime, 1),
+                'latency_scope': "送進 worker pool 的請求 (200/422/500/504)，不含快取命中與 400/411/413/503；分位數取最近 4096 筆",
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'inflight': len(self.inflight),
+                'cache_entries': len(self.cache),
+                'counters': dict(self.counters),
+                'endpoints': {},
+            }
+            for name, values in self.latency.items():
+                values = sorted(values)
+                result['endpoints'][name] = {
+                    'completed': self.completed[name], 'failed': self.failed[name],
+                    'p50_ms': pct(values, 0.50), 'p95_ms': pct(values, 0.95), 'p99_ms': pct(values, 0.99),
+                }
+        result['throughput_rps'] = round(done / uptime, 2) if uptime else 0.0
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- 4. HTTP 介面 ---
+
+class RosterRequestHandler(BaseHTTPRequestHandler):
+    service = None
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, payload, content_type='application/json; charset=utf-8', filename=None, close=False):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if filename:
+            # header 只能是 latin-1：ASCII 備援檔名 + RFC 6266 的 UTF-8 檔名
+            fallback = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_')
+            self.send_header('Content-Disposition',
+                             f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{urllib.parse.quote(filename)}')
+        # 未讀完的 body 會被 keep-alive 當成下一個請求解析，因此直接關閉連線
+        if close: self.send_header('Connection', 'close')
+        if status == 503: self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health': self._send(200, {'status': 'ok'})
+        elif self.path == '/metrics': self._send(200, self.service.metrics())
+        else: self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        endpoint = self.path.strip('/')
+        if endpoint not in JOBS:
+            self._send(404, {'error': 'not found'}, close=True)
+            return
+        start = time.perf_counter()
+        status, computed = 200, False
+        try:
+            raw_length = self.headers.get('Content-Length')
+            if raw_length is None:
+                status = 411
+                self._send(status, {'error': '缺少 Content-Length'}, close=True)
+                return
+            if not raw_length.strip().isdigit():
+                status = 400
+                self._send(status, {'error': 'Content-Length 格式錯誤'}, close=True)
+                return
+            length = int(raw_length)
+            if length > MAX_BODY_BYTES:
+                status = 413
+                self._send(status, {'error': '請求內容過大'}, close=True)
+                return
+            try: body = json.loads(self.rfile.read(length) or b'{}')
+            # 非 UTF-8 (UnicodeDecodeError 屬於 ValueError) 或巢狀過深的 JSON 都視為格式錯誤
+            except (ValueError, RecursionError): raise RequestError("JSON 格式錯誤")
+            req = parse_request(endpoint, body)
+            computed = True
+            result, cached = self.service.submit(endpoint, req)
+            computed = not cached
+            if endpoint == 'export':
+                self._send(200, result, 'application/zip', f"roster_{req['label']}.zip")
+            else:
+                status = result.get('status', 200) if 'error' in result else 200
+                self._send(status, result)
+        except (RequestError, ServiceBusy) as e:
+            status, computed = e.status, False
+            self._send(status, {'error': str(e)})
+        except FutureTimeout:
+            status = 504
+            self._send(status, {'error': f'排班逾時 (>{self.service.timeout:g} 秒)'})
+        except Exception as e:
+            status = 500
+            self._send(status, {'error': f'{type(e).__name__}: {e}'})
+        finally:
+            self.service.record(endpoint, status, time.perf_counter() - start, computed)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=8502, workers=4, queue_size=16, timeout=30.0, cache_size=256):
+    service = RosterService(workers, queue_size, timeout, cache_size)
+    handler = type('Handler', (RosterRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="成大整外住院醫師排班 HTTP 服務")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=4, help="排班 worker process 數")
+    parser.add_argument('--queue', type=int, default=16, help="排隊上限，超過回 503")
+    parser.add_argument('--timeout', type=float, default=30.0, help="每個請求的逾時秒數")
+    parser.add_argument('--cache', type=int, default=256, help="結果快取筆數")
+    args = parser.parse_args()
+
+    server, service = serve(args.host, args.port, args.workers, args.queue, args.timeout, args.cache)
+    print(f"排班服務啟動：http://{args.host}:{args.port} (workers={args.workers}, queue={args.queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    main()
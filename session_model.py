@@ -0,0 +1,136 @@
+import sys
+import weakref
+from array import array
+from dataclasses import dataclass
+from types import MappingProxyType
+
+# --- 精簡 Session 資料模型 ---
+# 名單 (Roster) 與月曆 (MonthCalendar) 為不可變物件，內容相同者在整個 process 只保留一份，
+# 由所有 session 共用；每個 session 只存一份以 bytes 編碼的班表與配額陣列。
+
+_ROSTER_POOL = weakref.WeakValueDictionary()
+_CALENDAR_POOL = weakref.WeakValueDictionary()
+
+
+@dataclass(frozen=True, eq=False, slots=True, weakref_slot=True)
+class Roster:
+    names: tuple
+    ranks: tuple
+    residents: tuple    # 唯讀 dict (name / rank / unavailable)，可直接傳入既有函式
+    index: MappingProxyType
+
+
+@dataclass(frozen=True, eq=False, slots=True, weakref_slot=True)
+class MonthCalendar:
+    year: int
+    month: int
+    flap_dates: frozenset
+    weekend_dates: frozenset
+    vs_schedule: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class CompactSchedule:
+    codes: bytes        # 每日 3 bytes：一線 / 二線 (名單序號+1，0 代表無人)、班別 (1=雙人)
+    warnings: tuple     # 僅保留有警示的日期 ((day, text), ...)
+
+
+def intern_roster(residents_data):
+    key = tuple((sys.intern(r['name']), r['rank'], frozenset(r['unavailable'])) for r in residents_data)
+    roster = _ROSTER_POOL.get(key)
+    if roster is None:
+        names = tuple(k[0] for k in key)
+        index = {}
+        for i, n in enumerate(names):
+            index.setdefault(n, i)
+        roster = Roster(
+            names=names,
+            ranks=tuple(k[1] for k in key),
+            residents=tuple(MappingProxyType({'name': n, 'rank': rk, 'unavailable': off}) for n, rk, off in key),
+            index=MappingProxyType(index),
+        )
+        _ROSTER_POOL[key] = roster
+    return roster
+
+
+def intern_calendar(year, month, flap_dates, weekend_dates, vs_schedule):
+    key = (int(year), int(month), frozenset(flap_dates), frozenset(weekend_dates), tuple(vs_schedule))
+    cal = _CALENDAR_POOL.get(key)
+    if cal is None:
+        cal = MonthCalendar(*key)
+        _CALENDAR_POOL[key] = cal
+    return cal
+
+
+def encode_schedule(schedule, roster):
+    codes = bytearray(3 * len(schedule))
+    warnings = []
+    for d, info in schedule.items():
+        i = (d - 1) * 3
+        codes[i] = roster.index[info['line1']] + 1 if info['line1'] else 0
+        codes[i + 1] = roster.index[info['line2']] + 1 if info['line2'] else 0
+        codes[i + 2] = 1 if info['type'] == 'double' else 0
+        if info.get('warning'): warnings.append((d, info['warning']))
+    return CompactSchedule(bytes(codes), tuple(warnings))
+
+
+def decode_schedule(packed, roster):
+    names = (None,) + roster.names
+    warnings = dict(packed.warnings)
+    codes = packed.codes
+    return {
+        d: {
+            'line1': names[codes[i]],
+            'line2': names[codes[i + 1]],
+            'type': 'double' if codes[i + 2] else 'single',
+            'warning': warnings.get(d, ''),
+        }
+        for d, i in ((i // 3 + 1, i) for i in range(0, len(codes), 3))
+    }
+
+
+def encode_quotas(quotas, roster):
+    return array('h', (quotas[n] for n in roster.names))
+
+
+def decode_quotas(packed, roster):
+    return dict(zip(roster.names, packed))
+
+
+# --- 記憶體量測 ---
+
+def deep_sizeof(obj, seen=None):
+    """
+    遞迴估算物件大小 (bytes)，同一物件只計一次
+    """
+    if seen is None: seen = set()
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, array, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, (dict, MappingProxyType)):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, s), seen) for s in obj.__slots__ if s != '__weakref__' and hasattr(obj, s))
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def measure_session_bytes(state):
+    """
+    回傳 (session 自有 bytes, 共用 bytes)。
+    共用的 Roster / MonthCalendar 不計入 session，另外列出。
+    """
+    shared_seen, own_seen = set(), set()
+    shared = own = 0
+    for value in state.values():
+        if isinstance(value, (Roster, MonthCalendar)):
+            shared += deep_sizeof(value, shared_seen)
+            own_seen.add(id(value))
+    for key, value in state.items():
+        own += deep_sizeof(key, own_seen) + deep_sizeof(value, own_seen)
+    return own, shared
@@ -0,0 +1,47 @@
+import io
+import zipfile
+
+import pytest
+
+import roster_export
+
+
+def _rosters(names):
+    schedule = {d: {'line1': names[d % 2], 'line2': names[2], 'type': 'double', 'warning': '連值 ' if d == 3 else ''}
+                for d in range(1, 32)}
+    return [(2026, 3, schedule, [5], [1, 7, 8])]
+
+
+def _zip(names, label='2026_3'):
+    residents = [{'name': n, 'rank': 'R3', 'unavailable': []} for n in names]
+    return zipfile.ZipFile(io.BytesIO(roster_export.build_export_zip(_rosters(names), residents, label)))
+
+
+def test_xlsx_loads_in_openpyxl():
+    openpyxl = pytest.importorskip('openpyxl')
+    zf = _zip(['甲', '乙', '丙'])
+    sheet = openpyxl.load_workbook(io.BytesIO(zf.read('schedule_2026_3.xlsx'))).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert list(rows[0]) == roster_export.COLUMNS
+    assert len(rows) == 32
+    assert rows[1][:5] == ('2026-03-01', 'Sun', '雙人', '乙', '丙')
+    assert rows[3][7] == '連值'
+
+
+def test_ics_lines_fold_at_75_bytes_without_splitting_utf8():
+    line = 'SUMMARY:' + '值班一線搭檔' * 20
+    folded = roster_export._ics_line(line)
+    parts = folded[:-2].split(b'\r\n')
+    assert len(parts) > 1
+    for i, part in enumerate(parts):
+        assert len(part) <= 75
+        part.decode('utf-8')    # 不可切斷多位元組字元
+        if i: assert part.startswith(b' ')
+    assert b''.join(p[1:] if i else p for i, p in enumerate(parts)).decode('utf-8') == line
+
+
+def test_resident_file_names_are_deduplicated():
+    zf = _zip(['a/b', 'a:b', 'a?b'])
+    ics = sorted(n for n in zf.namelist() if n.startswith('ics/'))
+    assert ics == ['ics/a_b_2026_3.ics', 'ics/a_b__2026_3.ics', 'ics/a_b___2026_3.ics']
+    assert b'X-WR-CALNAME:a:b' in zf.read('ics/a_b__2026_3.ics')
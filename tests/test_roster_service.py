@@ -0,0 +1,111 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+
+import pytest
+
+import roster_service
+
+RANKS = ['R3', 'R3', 'R4', 'R4', 'R5', 'R5', 'R6', 'R6']
+
+
+def _request(schedule):
+    body = {
+        'year': 2026, 'month': 3,
+        'residents': [{'name': f'D{i}', 'rank': rk} for i, rk in enumerate(RANKS)],
+        'schedule': schedule,
+    }
+    return roster_service.parse_request('repair', body)
+
+
+def _base_schedule():
+    body = {'year': 2026, 'month': 3, 'seed': 7,
+            'residents': [{'name': f'D{i}', 'rank': rk} for i, rk in enumerate(RANKS)]}
+    result = roster_service.job_generate(roster_service.parse_request('generate', body))
+    return {d: {'line1': info['line1'], 'line2': info['line2']} for d, info in result['schedule'].items()}
+
+
+def test_repair_reports_every_kept_shift_it_cannot_place():
+    # R5 排在一線、R6 排在二線：排班引擎會把兩人都放到二線，其中一人被覆蓋
+    schedule = _base_schedule()
+    schedule['2'] = {'line1': 'D5', 'line2': 'D6'}
+    schedule['3'] = {'line1': schedule['3']['line1'], 'line2': 'D5'}
+    if schedule['4']['line2'] == 'D5': schedule['4']['line2'] = 'D7'
+
+    result = roster_service.job_repair(_request(schedule))
+
+    dropped = {(x['day'], x['name']) for x in result['dropped']}
+    assert (2, 'D5') in dropped
+    for key, info in schedule.items():
+        d, placed = int(key), result['schedule'][key]
+        for n in (info['line1'], info['line2']):
+            if n: assert n in (placed['line1'], placed['line2']) or (d, n) in dropped, (d, n)
+    # 第 2 天的 D5 已剔除，第 3 天不應再被視為連值
+    assert result['schedule']['3']['line2'] == 'D5'
+    assert result['schedule']['2']['line2'] == 'D6'
+
+
+@pytest.mark.parametrize('endpoint, patch', [
+    ('generate', {'year': 0}),
+    ('generate', {'year': True}),
+    ('generate', {'month': False}),
+    ('generate', {'seed': True}),
+    ('generate', {'vs_schedule': 'abc'}),
+    ('generate', {'vs_schedule': [1, 2]}),
+    ('export', {'months': [1]}),
+    ('export', {'months': [{'year': 99999, 'month': 1}]}),
+    ('generate', {'residents': [{'name': '', 'rank': 'R3'}]}),
+    ('generate', {'residents': [{'name': ' D0', 'rank': 'R3'}]}),
+])
+def test_parse_request_rejects_malformed_input(endpoint, patch):
+    body = {'year': 2026, 'month': 3, 'residents': [{'name': f'D{i}', 'rank': rk} for i, rk in enumerate(RANKS)]}
+    body.update(patch)
+    with pytest.raises(roster_service.RequestError):
+        roster_service.parse_request(endpoint, body)
+
+
+def _export_body(label):
+    schedule = {str(d): {'line1': 'D0', 'line2': 'D4'} for d in range(1, 32)}
+    return {'year': 2026, 'month': 3, 'residents': [{'name': f'D{i}', 'rank': rk} for i, rk in enumerate(RANKS)],
+            'schedule': schedule, 'label': label}
+
+
+@pytest.mark.parametrize('label', ['a"\r\nX-Evil: 1', '../../x', 'a/b', '..', 'tab\there'])
+def test_export_rejects_unsafe_label(label):
+    with pytest.raises(roster_service.RequestError):
+        roster_service.parse_request('export', _export_body(label))
+
+
+def test_export_non_ascii_label_is_sent_as_rfc6266_filename():
+    server, service = roster_service.serve(port=0, workers=1, queue_size=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        data = json.dumps(_export_body('三月')).encode('utf-8')
+        url = f'http://127.0.0.1:{server.server_address[1]}/export'
+        with urllib.request.urlopen(urllib.request.Request(url, data), timeout=30) as r:
+            disposition = r.headers['Content-Disposition']
+            names = zipfile.ZipFile(io.BytesIO(r.read())).namelist()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+    assert disposition == "attachment; filename=\"roster___.zip\"; filename*=UTF-8''roster_%E4%B8%89%E6%9C%88.zip"
+    assert 'schedule_三月.csv' in names
+
+
+@pytest.mark.parametrize('body', [b'\xff\xfe{', b'[' * 100000 + b']' * 100000])
+def test_undecodable_body_is_400(body):
+    server, service = roster_service.serve(port=0, workers=1, queue_size=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/generate'
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(urllib.request.Request(url, body), timeout=30)
+        assert e.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()